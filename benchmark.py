@@ -0,0 +1,688 @@
+"""Benchmarks del Logbuch sobre datos sintéticos.
+
+    python benchmark.py queries              # 10k, 100k y 1M filas
+    python benchmark.py queries --rows 50000 --repeat 10
+    python benchmark.py pdf --rows 10000 100000
+    python benchmark.py stress --rows 100000
+    python benchmark.py style --rows 50000
+    python benchmark.py startup --rows 100000 --repeat 5
+    python benchmark.py search --rows 1000000
+    python benchmark.py plans --rows 100000
+    python benchmark.py datapath --rows 10000 100000 --save-baseline
+    python benchmark.py fragments --rows 100000
+    python benchmark.py memory --rows 500000
+    python benchmark.py archive --rows 100000
+    python benchmark.py datapath --rows 10000 100000 --users 80 --seed 7
+
+Para cada tamaño se genera una base temporal. `queries` mide las consultas
+del dashboard sin índices (esquema original) y tras la migración con índices;
+`pdf` compara el exporte PDF anterior (DataFrame + texto) con pdf_report;
+`stress` simula altas y cargas del dashboard concurrentes; `style` compara el
+coloreado de la tabla con Styler.applymap frente a column_config; `startup`
+mide el arranque en frío (import + primer render) en procesos nuevos y añade
+el resultado a STARTUP_HISTORY para seguirlo en el tiempo; `search` mide la
+búsqueda de texto completo (primera página y página 100); `plans` comprueba
+con EXPLAIN QUERY PLAN que cada combinación de OpsFilter usa un índice y
+termina con código 1 si alguna recorre operationen entera; `datapath` cronometra
+cada función de lectura, exporte y escritura de la app y, con la línea base de
+--save-baseline (BASELINE), termina con código 1 si alguna empeora más de
+--tolerance. Los datos (`generate`) dependen sólo de --rows, --users y --seed (fechas relativas a hoy),
+así que dos ejecuciones miden la misma base; no hace falta red. `fragments`
+compara, por interacción, el rerun completo de la app con el de los fragmentos
+que esa interacción vuelve a ejecutar; `memory` compara tiempo y pico de
+memoria (tracemalloc) de fetch_ops con la carga anterior (fetchall + object),
+con el tamaño de referencia --rows 500000 (pico 4.0x menor para un residente y
+4.7x para el tutor; con pocas filas pesan los costes fijos y el factor baja);
+`archive` repite las funciones de `datapath` tras archivar los años cerrados.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import date, timedelta
+from itertools import accumulate
+
+import pandas as pd
+
+from streamlit.logger import set_log_level
+
+set_log_level("error")  # modo "bare": sin runtime de Streamlit
+import db  # noqa: E402
+from katalog import (ANNUAL_GOALS, EINGRIFFE, KATEGORIEN, ROLLEN,  # noqa: E402
+                     VERSCHLUSSSYSTEM, ZUGAENGE)
+
+INDICES = ["idx_ops_user_datum", "idx_ops_user_uid", "idx_ops_datum"]
+
+# ─── DATOS SINTÉTICOS ─────────────────────────────────────────────────────────
+# Reproducibles con `seed`. Cada residente tiene un año de residencia (1-6): sus
+# casos empiezan entonces, su actividad sigue una lognormal y su reparto como
+# Operateur crece con la experiencia. Dentro de cada categoría los Eingriffe
+# siguen una Zipf (pocos muy frecuentes); los fines de semana hay pocos casos.
+KAT_WEIGHTS = {"Operation": 5, "Intervention": 3, "Prozedur": 2}
+GEN = dict(n_users=40, years=5, seed=1)   # --users / --seed
+
+def generate(conn, n_rows, n_users=40, years=5, seed=1):
+    rnd   = random.Random(seed)
+    users = [f"resident{i:03d}" for i in range(n_users)]
+    today = date.today()
+    first = today.replace(month=1, day=1) - timedelta(days=365 * (years - 1))
+    level = {u: rnd.randint(1, 6) for u in users}
+    start = {u: max(first, today - timedelta(days=365 * level[u])) for u in users}
+    span  = {u: (today - start[u]).days + 1 for u in users}
+    p_op  = {u: min(0.1 + 0.13 * level[u], 0.85) for u in users}
+    act   = [rnd.lognormvariate(0, 0.5) * span[u] for u in users]
+    eingriffe, zipf = {}, {}
+    for kat, es in EINGRIFFE.items():
+        eingriffe[kat] = rnd.sample(es, len(es))
+        zipf[kat] = list(accumulate(1 / r for r in range(1, len(es) + 1)))
+    kats, kat_w = list(KAT_WEIGHTS), list(accumulate(KAT_WEIGHTS.values()))
+    user_w = list(accumulate(act))
+    uid    = dict.fromkeys(users, 0)
+
+    conn.executemany(
+        "INSERT INTO users (username, password, security_question, security_answer) "
+        "VALUES (?, ?, '', '')",
+        ((u, hashlib.sha256(u.encode()).hexdigest()) for u in users))
+
+    def rows():
+        for _ in range(n_rows):
+            u = rnd.choices(users, cum_weights=user_w)[0]
+            k = rnd.choices(kats, cum_weights=kat_w)[0]
+            d = start[u] + timedelta(days=rnd.randrange(span[u]))
+            if d.weekday() >= 5 and rnd.random() < 0.8:
+                d -= timedelta(days=d.weekday() - 4)   # al viernes anterior
+            uid[u] += 1
+            zugang = rnd.choice(ZUGAENGE) if k == "Intervention" else ""
+            versch = rnd.choice(VERSCHLUSSSYSTEM) if zugang == "Punktion" else ""
+            rolle  = "Operateur" if rnd.random() < p_op[u] + (0.1 if k == "Prozedur" else 0) \
+                     else "Assistent"
+            yield encode(dict(
+                datum=d.isoformat(), eingriff=rnd.choices(eingriffe[k], cum_weights=zipf[k])[0],
+                rolle=rolle, patient_id=f"P{rnd.randrange(10**6)}", diagnose="Diagnose",
+                kategorie=k, zugang=zugang, verschlusssystem=versch,
+                notizen="Kontrolle" if rnd.random() < 0.05 else "")) + (bid[u], uid[u])
+
+    encode = db._encoder(conn)
+    bid    = dict(conn.execute("SELECT username, id FROM users"))
+    conn.executemany(
+        f"INSERT INTO operationen ({db._ENC_COLS}, benutzer_id, user_id) "
+        f"VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows())
+    return max(users, key=uid.get)   # el residente con más casos
+
+def timed(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); runs.append(time.perf_counter() - t0)
+    return statistics.median(runs) * 1000
+
+def dashboard_queries(user, year):
+    # Se llama a la función sin caché (__wrapped__) para medir sólo SQLite.
+    return {
+        "fetch_dashboard(user)":    lambda: db._q_dashboard.__wrapped__(user, year, 0),
+        "fetch_top_eingriffe":      lambda: db._q_top_eingriffe.__wrapped__(user, 0),
+        "fetch_ops(user)":          lambda: db.fetch_ops(user, False),
+        "fetch_dashboard(tutor)":   lambda: db._q_dashboard.__wrapped__(None, year, 0),
+        "fetch_ranking":            lambda: db._q_ranking.__wrapped__(0),
+    }
+
+@contextlib.contextmanager
+def bench_db(n_rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.reset_pool()
+        t0 = time.perf_counter()
+        with db.writer() as conn:
+            user = generate(conn, n_rows, **GEN)
+            conn.execute("ANALYZE")  # como tras la migración de una base con datos
+        print(f"\n── {n_rows:,} filas (generadas en {time.perf_counter() - t0:.1f}s) ──")
+        try:
+            yield user
+        finally:
+            db.reset_pool()
+
+def run_queries(n_rows, repeat):
+    with bench_db(n_rows) as user:
+        queries = dashboard_queries(user, date.today().year)
+        with db.writer() as conn:
+            for idx in INDICES:
+                conn.execute(f"DROP INDEX IF EXISTS {idx}")
+        before = {name: timed(fn, repeat) for name, fn in queries.items()}
+        with db.writer() as conn:
+            db._compact_indices(conn.cursor())
+            conn.execute("ANALYZE")
+        after  = {name: timed(fn, repeat) for name, fn in queries.items()}
+
+        print(f"{'consulta':<24}{'sin índice':>12}{'con índice':>12}{'factor':>9}")
+        for name in queries:
+            b, a = before[name], after[name]
+            print(f"{name:<24}{b:>10.2f}ms{a:>10.2f}ms{b / a if a else 0:>8.1f}x")
+
+# Exporte PDF anterior a pdf_report (referencia para la comparación).
+def legacy_pdf_bytes(df, title):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas as rl_canvas
+    buf = io.BytesIO()
+    c   = rl_canvas.Canvas(buf, pagesize=letter)
+    c.setFont("Helvetica-Bold", 14); c.drawString(60, 760, title)
+    c.setFont("Helvetica", 8); y = 730
+    for _, row in df.iterrows():
+        text = " | ".join(str(v) for v in row if v)
+        while len(text) > 120:
+            c.drawString(40, y, text[:120]); text = "  " + text[120:]; y -= 13
+            if y < 50: c.showPage(); c.setFont("Helvetica", 8); y = 750
+        c.drawString(40, y, text); y -= 18
+        if y < 50: c.showPage(); c.setFont("Helvetica", 8); y = 750
+    c.save(); buf.seek(0)
+    return buf.read()
+
+def measured(fn):
+    t0 = time.perf_counter(); out = fn(); secs = time.perf_counter() - t0
+    tracemalloc.start(); fn(); peak = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+    return secs, peak, len(out)
+
+# _Canvas (pdf_report.py) toca objetos internos de ReportLab; se comprueba que
+# el PDF sigue siendo legible: tabla xref, streams FlateDecode y páginas.
+def pdf_errors(data):
+    xref = int(data[data.rindex(b"startxref") + 9:].split()[0])
+    head, body = data[xref:].split(b"trailer", 1)[0].split(b"\n", 2)[1:]
+    first, count = map(int, head.split())
+    errors = []
+    for n, entry in enumerate(body.split(b"\n")[:count], first):
+        off, _, kind = entry.split()[:3]
+        if kind == b"n" and not data[int(off):].startswith(b"%d 0 obj" % n):
+            errors.append(f"xref {n} apunta a {int(off)}")
+    for m in re.finditer(rb"<<([^<>]*)>>\s*stream\r?\n", data):
+        length = int(re.search(rb"/Length (\d+)", m[1])[1])
+        raw    = data[m.end():m.end() + length]
+        try:
+            if b"FlateDecode" in m[1]: zlib.decompress(raw)
+        except zlib.error as e:
+            errors.append(f"stream en {m.end()}: {e}")
+    pages = len(re.findall(rb"/Type /Page\b", data))
+    declared = sum(int(c) for c in re.findall(rb"/Count (\d+)", data))
+    if pages != declared:
+        errors.append(f"{pages} páginas, /Count {declared}")
+    return errors
+
+def run_pdf(n_rows, repeat):
+    from pdf_report import make_report_pdf
+    with bench_db(n_rows) as user:
+        year    = date.today().year
+        summary = dict(year=year, kategorien=KATEGORIEN, goals=ANNUAL_GOALS,
+                       dashboard=db.fetch_dashboard(None, year))
+        variants = {
+            "make_pdf_bytes (alt)": lambda: legacy_pdf_bytes(
+                legacy_fetch_ops(user, True), "Logbuch"),
+            "pdf_report":           lambda: make_report_pdf(
+                "Logbuch", db.ops_headers(True), db.iter_ops(user, True), summary),
+        }
+        print(f"{'variante':<24}{'tiempo':>10}{'filas/s':>11}{'pico mem':>12}{'PDF':>10}")
+        for name, fn in variants.items():
+            secs, peak, size = measured(fn)
+            print(f"{name:<24}{secs:>9.2f}s{n_rows / secs:>11,.0f}"
+                  f"{peak / 2**20:>10.1f}MB{size / 2**20:>8.1f}MB")
+        errors = pdf_errors(variants["pdf_report"]())
+        if errors:
+            raise SystemExit("PDF ilegible: " + "; ".join(errors[:5]))
+
+# fetch_ops anterior a la carga columnar: fetchall de las columnas de texto de
+# ops_view y DataFrame de columnas object (referencia para `memory`).
+def legacy_fetch_ops(user, is_tutor, flt=None):
+    cols = db.OPS_COLS[is_tutor]
+    sql, p = db._ops_sql(",".join(c for c, _ in cols), user, is_tutor, flt)
+    if not is_tutor: sql += " ORDER BY user_id"
+    rows = db.get_cur().execute(sql, p).fetchall()
+    return pd.DataFrame(rows, columns=[h for _, h in cols])
+
+def run_memory(n_rows, repeat):
+    with bench_db(n_rows) as user:
+        print(f"{'variante':<26}{'vista':<8}{'tiempo':>10}{'pico mem':>11}"
+              f"{'DataFrame':>11}{'factor':>8}")
+        for is_tutor in (False, True):
+            base = None
+            for name, fn in [("fetchall + object (alt)", legacy_fetch_ops),
+                             ("fetch_ops (columnar)",    db.fetch_ops)]:
+                ms = timed(lambda: fn(user, is_tutor), repeat)
+                tracemalloc.start()
+                df   = fn(user, is_tutor)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                size = df.memory_usage(deep=True).sum()
+                base = base or peak
+                print(f"{name:<26}{'tutor' if is_tutor else 'resid.':<8}{ms:>8.1f}ms"
+                      f"{peak / 2**20:>9.1f}MB{size / 2**20:>9.1f}MB{base / peak:>7.1f}x")
+                del df
+
+# Styler anterior a table_style: applymap (hoy Styler.map), una llamada de
+# Python por celda más el CSS de cada celda.
+def legacy_style(df, palette):
+    def style_rolle(val):
+        if val == "Operateur": return f"color: {palette['accent']}; font-weight: bold"
+        if val == "Assistent": return f"color: {palette['accent2']}; font-weight: bold"
+        return ""
+    def style_kat(val):
+        m = {"Operation": palette["op"], "Intervention": palette["interv"],
+             "Prozedur": palette["proz"]}
+        return f"color: {m.get(val, palette['text'])}; font-weight: bold"
+    return (df.style.map(style_rolle, subset=["Rolle"])
+                    .map(style_kat, subset=["Kategorie"]))
+
+def run_style(n_rows, repeat):
+    from streamlit.dataframe_util import convert_pandas_df_to_arrow_bytes
+    from streamlit.elements.lib.pandas_styler_utils import marshall_styler
+    from streamlit.proto.ArrowData_pb2 import ArrowData
+    from table_style import ops_column_config
+    palette = {k: f"#{i:06x}" for i, k in enumerate(
+        ["accent", "accent2", "op", "interv", "proz", "text"])}
+    rnd = random.Random(1)
+    df  = pd.DataFrame({
+        "ID":        range(1, n_rows + 1),
+        "Eingriff":  [rnd.choice(EINGRIFFE["Operation"]) for _ in range(n_rows)],
+        "Rolle":     [rnd.choice(ROLLEN) for _ in range(n_rows)],
+        "Kategorie": [rnd.choice(KATEGORIEN) for _ in range(n_rows)],
+    })
+
+    # Lo que hace st.dataframe en Python antes de enviar la tabla al navegador.
+    def styler():
+        styled = legacy_style(df, palette)
+        marshall_styler(ArrowData(), styled, "bench")
+        return convert_pandas_df_to_arrow_bytes(styled.data)
+
+    def column_config():
+        ops_column_config(palette)
+        return convert_pandas_df_to_arrow_bytes(df)
+
+    print(f"\n── {n_rows:,} filas ──")
+    variants = {"Styler + applymap": styler, "column_config": column_config}
+    print(f"{'variante':<24}{'tiempo':>11}{'pico mem':>12}")
+    for name, fn in variants.items():
+        ms = timed(fn, repeat)
+        tracemalloc.start(); fn(); peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<24}{ms:>9.1f}ms{peak / 2**20:>10.1f}MB")
+
+# Arranque en frío: cada medición es un proceso nuevo que importa Streamlit y
+# renderiza la app una vez (como tras despertar la app alojada) y otra en
+# caliente. También se anota qué módulos pesados se llegaron a cargar.
+STARTUP_HISTORY = "startup_history.jsonl"
+_STARTUP_CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=300)
+at.session_state["logged_in"] = True
+at.session_state["username"]  = sys.argv[2]
+at.session_state["is_tutor"]  = False
+at.run()
+t2 = time.perf_counter()
+at.run()
+t3 = time.perf_counter()
+assert not at.exception, [e.message for e in at.exception]
+print(json.dumps({"import_streamlit": t1 - t0, "first_render": t2 - t1,
+                  "rerun": t3 - t2,
+                  "loaded": [m for m in ("reportlab", "plotly.express", "pyarrow",
+                                         "openpyxl") if m in sys.modules]}))
+"""
+
+def run_startup(n_rows, repeat):
+    import subprocess
+    import sys
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logbuch.py")
+    with bench_db(n_rows) as user:
+        env  = dict(os.environ, LOGBUCH_DB=db.DB_PATH)
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, "-c", _STARTUP_CHILD, app, user],
+                                 env=env, capture_output=True, text=True, check=True)
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        res = {k: statistics.median(r[k] for r in runs) * 1000
+               for k in ("import_streamlit", "first_render", "rerun")}
+        for k, v in res.items():
+            print(f"{k:<20}{v:>9.0f}ms")
+        print(f"{'módulos cargados':<20} {', '.join(runs[0]['loaded']) or '-'}")
+        with open(STARTUP_HISTORY, "a") as f:
+            f.write(json.dumps(dict(ts=time.strftime("%Y-%m-%dT%H:%M:%S"), rows=n_rows,
+                                    **{k: round(v, 1) for k, v in res.items()})) + "\n")
+
+SEARCH_TERMS = ["diagnose", "evar", "P12345", "carotis bypass", "zzz"]
+
+def run_search(n_rows, repeat):
+    with bench_db(n_rows) as user:
+        print(f"{'búsqueda':<22}{'residente':>11}{'tutor':>11}{'tutor p.100':>13}{'aciertos':>10}")
+        for q in SEARCH_TERMS:
+            res  = timed(lambda: db._q_search_ops.__wrapped__(user, False, q, 0, 25, 0), repeat)
+            tut  = timed(lambda: db._q_search_ops.__wrapped__(user, True, q, 0, 25, 0), repeat)
+            deep = timed(lambda: db._q_search_ops.__wrapped__(user, True, q, 100, 25, 0), repeat)
+            hits = db._q_search_ops.__wrapped__(user, True, q, 0, 25, 0)[1]
+            print(f"{q!r:<22}{res:>9.1f}ms{tut:>9.1f}ms{deep:>11.1f}ms{hits:>10}")
+
+# Combinaciones de OpsFilter representativas de la pantalla del Logbuch.
+PLAN_FILTERS = {
+    "sin filtro":       db.OpsFilter(),
+    "kategorie":        db.OpsFilter(kategorie="Intervention"),
+    "rolle":            db.OpsFilter(rolle="Operateur"),
+    "zeitraum":         db.OpsFilter(von="2024-01-01", bis="2024-06-30"),
+    "eingriff":         db.OpsFilter(eingriff="EVAR"),
+    "zugang+verschluss": db.OpsFilter(kategorie="Intervention", zugang="Punktion",
+                                      verschlusssystem="ProGlide"),
+    "benutzer+zeitraum": db.OpsFilter(benutzer="resident001", von="2024-01-01"),
+    "todo":             db.OpsFilter(kategorie="Intervention", rolle="Operateur",
+                                     von="2023-01-01", bis="2024-12-31", eingriff="EVAR",
+                                     zugang="Punktion", verschlusssystem="ProGlide"),
+}
+
+def _plan(sql, p):
+    plan = db.get_cur().execute("EXPLAIN QUERY PLAN " + sql, p).fetchall()
+    return " / ".join(r[-1] for r in plan)
+
+def run_plans(n_rows, repeat):
+    full_scans = 0
+    with bench_db(n_rows) as user:
+        print(f"{'filtro':<20}{'vista':<8}{'count':>9}{'página':>9}  plan (página)")
+        for name, flt in PLAN_FILTERS.items():
+            for is_tutor in (False, True):
+                if flt.benutzer and not is_tutor:
+                    continue
+                cnt  = timed(lambda: db._q_count_ops.__wrapped__(user, is_tutor, flt, 0), repeat)
+                page = timed(lambda: db._q_ops_page.__wrapped__(user, is_tutor, flt, None,
+                                                                50, 0), repeat)
+                plans = [_plan(*db._ops_sql("COUNT(*)", user, is_tutor, flt,
+                                            src="operationen")),
+                         _plan(db._ops_sql("id", user, is_tutor, flt)[0]
+                               + " ORDER BY datum, id LIMIT 51",
+                               db._ops_sql("id", user, is_tutor, flt)[1])]
+                bad = [pl for pl in plans if "SCAN operationen" in pl
+                       and "INDEX" not in pl]
+                full_scans += len(bad)
+                print(f"{name:<20}{'tutor' if is_tutor else 'resid.':<8}{cnt:>7.1f}ms"
+                      f"{page:>7.1f}ms  {plans[1]}{'  <-- SCAN' if bad else ''}")
+    if full_scans:
+        raise SystemExit(f"{full_scans} consultas recorren operationen sin índice")
+
+# Prueba de carga: `threads` residentes registran casos a la vez mientras otros
+# tantos hilos cargan el dashboard y la primera página del Logbuch. Al final se
+# comprueba que cada residente tiene user_id 1..n sin duplicados ni huecos.
+def run_stress(n_rows, repeat, threads=32, per_thread=25):
+    with bench_db(n_rows):
+        year = date.today().year
+        lat  = {"insert": [], "dashboard": []}
+        errors = []
+
+        def insert_cases(i):
+            uname = f"stress{i:03d}"
+            for k in range(per_thread):
+                t0 = time.perf_counter()
+                db.insert_op(uname, dict(
+                    datum=f"{year}-01-01", eingriff="EVAR", rolle="Operateur",
+                    patient_id=f"S{k}", diagnose="Diagnose",
+                    kategorie="Intervention", zugang="Punktion", verschlusssystem="ProGlide"))
+                lat["insert"].append(time.perf_counter() - t0)
+
+        def load_dashboard(i):
+            uname = f"stress{i:03d}"
+            for _ in range(per_thread):
+                t0 = time.perf_counter()
+                db._q_dashboard.__wrapped__(uname, year, 0)
+                db._q_ranking.__wrapped__(0)
+                db.fetch_ops_page(uname, False)
+                lat["dashboard"].append(time.perf_counter() - t0)
+
+        def guarded(fn, i):
+            try:
+                fn(i)
+            except Exception as e:  # noqa: BLE001 - se informan al final
+                errors.append(repr(e))
+
+        t0 = time.perf_counter()
+        workers = [threading.Thread(target=guarded, args=(fn, i))
+                   for i in range(threads) for fn in (insert_cases, load_dashboard)]
+        for w in workers: w.start()
+        for w in workers: w.join()
+        wall = time.perf_counter() - t0
+
+        bad = db.get_cur().execute("""
+            SELECT username FROM ops_view WHERE username LIKE 'stress%'
+            GROUP BY username
+            HAVING COUNT(*) != ? OR COUNT(DISTINCT user_id) != COUNT(*) OR MAX(user_id) != ?""",
+            (per_thread, per_thread)).fetchall()
+        print(f"{threads} escritores + {threads} lectores, {per_thread} operaciones c/u, "
+              f"{wall:.2f}s")
+        for kind, xs in lat.items():
+            xs.sort()
+            print(f"  {kind:<10} n={len(xs):<5} p50={xs[len(xs) // 2] * 1000:7.1f}ms "
+                  f"p95={xs[int(len(xs) * 0.95)] * 1000:7.1f}ms")
+        print(f"  errores: {len(errors)}  residentes con user_id incorrectos: {len(bad)}")
+        for e in errors[:5]:
+            print("   ", e)
+
+        # Varios procesos (cada uno con su propio escritor) dando de alta al
+        # mismo usuario: BEGIN IMMEDIATE serializa las altas entre procesos.
+        procs, n = 4, per_thread * 4
+        ctx = multiprocessing.get_context("spawn")
+        t0  = time.perf_counter()
+        with ctx.Pool(procs) as pool:
+            pool.starmap(_hammer, [(db.DB_PATH, "shared", n)] * procs)
+        got = db.get_cur().execute(
+            "SELECT COUNT(*), COUNT(DISTINCT user_id), MAX(user_id) FROM ops_view "
+            "WHERE username='shared'").fetchone()
+        ok  = got == (procs * n, procs * n, procs * n)
+        print(f"{procs} procesos x {n} altas al mismo usuario: {time.perf_counter() - t0:.2f}s, "
+              f"user_id {'correctos' if ok else f'INCORRECTOS {got}'}")
+        fallos = [msg for msg, mal in [
+            (f"{len(errors)} errores en los hilos", errors),
+            (f"{len(bad)} residentes con user_id duplicados o con huecos", bad),
+            (f"user_id de 'shared' incorrectos: {got}", not ok)] if mal]
+        if fallos:
+            raise SystemExit("Test de carga fallido: " + "; ".join(fallos))
+
+def _hammer(path, uname, n):
+    db.DB_PATH = path
+    db.reset_pool()
+    for k in range(n):
+        db.insert_op(uname, dict(datum="2024-01-01", eingriff="EVAR", rolle="Operateur",
+                                 patient_id=f"H{k}", diagnose="Diagnose",
+                                 kategorie="Intervention"))
+
+# Latencia por interacción con las secciones como fragmentos (logbuch.py). AppTest
+# ejecuta el script completo en cada interacción, así que en la misma ejecución se
+# mide el rerun completo (antes: cada interacción lo pagaba) y el tiempo de los
+# fragmentos que esa interacción vuelve a ejecutar ahora (profiling "fragment").
+def _fragment_interactions(at, is_tutor, year):
+    def select(label):
+        def act(i):
+            sb = next(x for x in at.selectbox if x.label == label)
+            sb.select(sb.options[(i + 1) % len(sb.options)])
+        return act
+    def page(i):
+        btn = at.button(key="log_fwd" if i % 2 == 0 else "log_back")
+        if not btn.disabled:
+            btn.click()
+    def set_year(i):
+        at.session_state["sel_year"] = year - (i + 1) % 2
+    def submit_invalid(i):
+        next(b for b in at.button if "Hinzufügen" in b.label).click()
+    out = {
+        "Filter Kategorie": (select("Kategorie"), ["logbuch"]),
+        "Seite ▶ / ◀":      (page, ["logbuch"]),
+        "Jahr ◀ ▶":         (set_year, ["dashboard", "export"]),
+        "Exportformat":     (select("Format"), ["export"]),
+    }
+    if not is_tutor:
+        out["Formular (Fehler)"] = (submit_invalid, ["neue_op"])
+    return out
+
+def run_fragments(n_rows, repeat):
+    import profiling
+    from streamlit.testing.v1 import AppTest
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logbuch.py")
+    with bench_db(n_rows) as user:
+        year = date.today().year
+        print(f"{'interacción':<20}{'vista':<8}{'rerun app':>11}{'fragmentos':>12}{'factor':>8}")
+        for is_tutor in (False, True):
+            at = AppTest.from_file(app, default_timeout=300)
+            at.session_state["logged_in"] = True
+            at.session_state["username"]  = user
+            at.session_state["is_tutor"]  = is_tutor
+            at.run()
+            for name, (act, frags) in _fragment_interactions(at, is_tutor, year).items():
+                full, part = [], []
+                for i in range(repeat):
+                    act(i)
+                    t0 = time.time()
+                    at.run()
+                    assert not at.exception, [e.message for e in at.exception]
+                    ev = [e for e in profiling.snapshot()[1] if e["ts"] >= t0]
+                    full.append(sum(e["ms"] for e in ev if e["kind"] == "rerun"))
+                    part.append(sum(e["ms"] for e in ev
+                                    if e["kind"] == "fragment" and e["name"] in frags))
+                f, p = statistics.median(full), statistics.median(part)
+                print(f"{name:<20}{'tutor' if is_tutor else 'resid.':<8}{f:>9.1f}ms"
+                      f"{p:>10.1f}ms{f / p if p else 0:>7.1f}x")
+
+# Todas las funciones del camino de datos, sin runtime de Streamlit y sin la
+# caché de st.cache_data (__wrapped__), sobre un residente típico y el tutor.
+# Las escrituras van al final: cada repetición añade, borra o renumera casos.
+BASELINE = "benchmark_baseline.json"
+TOLERANCE = 0.25        # regresión: más de un 25 % y más de 1 ms por encima
+
+def datapath_functions(user, year):
+    from cohort import _q_cohort
+    from export import export_bytes
+    from pdf_report import make_pdf_bytes
+    flt = db.OpsFilter(kategorie="Intervention", von=f"{year - 1}-01-01")
+    op  = dict(datum=f"{year}-01-01", eingriff="EVAR", rolle="Operateur",
+               patient_id="B1", diagnose="Diagnose",
+               kategorie="Intervention", zugang="Punktion", verschlusssystem="ProGlide")
+    return {
+        "fetch_ops(resid.)":      lambda: db.fetch_ops(user, False),
+        "fetch_ops(tutor, flt)":  lambda: db.fetch_ops(user, True, flt),
+        "fetch_ops_page(tutor)":  lambda: db._q_ops_page.__wrapped__(user, True, flt, None,
+                                                                     50, 0),
+        "count_ops(tutor)":       lambda: db._q_count_ops.__wrapped__(user, True, flt, 0),
+        "fetch_dashboard(resid.)": lambda: db._q_dashboard.__wrapped__(user, year, 0),
+        "fetch_dashboard(tutor)": lambda: db._q_dashboard.__wrapped__(None, year, 0),
+        "fetch_ranking":          lambda: db._q_ranking.__wrapped__(0),
+        "fetch_top_eingriffe":    lambda: db._q_top_eingriffe.__wrapped__(user, 0),
+        "fetch_cohort":           lambda: _q_cohort.__wrapped__(
+                                      year, tuple(ANNUAL_GOALS.items()), 0),
+        "search_ops(tutor)":      lambda: db._q_search_ops.__wrapped__(user, True, "evar",
+                                                                       0, 25, 0),
+        "export CSV (resid.)":    lambda: export_bytes("CSV", db.ops_headers(False),
+                                                       db.iter_ops(user, False)),
+        "make_pdf_bytes(resid.)": lambda: make_pdf_bytes(user, False, None, "Logbuch", year),
+        "insert_op":              lambda: db.insert_op(user, op),
+        "bulk_insert_ops(500)":   lambda: db.bulk_insert_ops(user, [op] * 500),
+        "delete_ops(1. Eintrag)": lambda: db.delete_ops(user, [1]),
+        "reorder_ids":            lambda: db.reorder_ids(user),
+    }
+
+def run_datapath(n_rows, repeat):
+    with bench_db(n_rows) as user:
+        fns = datapath_functions(user, date.today().year)
+        res = {}
+        for name, fn in fns.items():
+            res[name] = timed(fn, repeat)
+            print(f"{name:<26}{res[name]:>10.2f}ms")
+        return res
+
+# Las mismas funciones con todos los años en operationen y tras archivar los
+# cerrados salvo el anterior (maintenance.py archive), más el tamaño de la base
+# principal tras VACUUM. Las escrituras de la primera pasada quedan en la base.
+def run_archive(n_rows, repeat):
+    with bench_db(n_rows) as user:
+        year = date.today().year
+        fns  = datapath_functions(user, year)
+        hot  = {name: timed(fn, repeat) for name, fn in fns.items()}
+        size = []
+        for archive in (False, True):
+            if archive:
+                for jahr in range(year - GEN["years"], year - 1):
+                    db.archive_year(jahr)
+            with db.writer() as conn:
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size.append(os.path.getsize(db.DB_PATH))
+        arch = {name: timed(fn, repeat) for name, fn in fns.items()}
+        print(f"archivados {db.archived_years()}; base principal "
+              f"{size[0] / 2**20:.1f}MB -> {size[1] / 2**20:.1f}MB")
+        print(f"{'función':<26}{'sin archivo':>12}{'con archivo':>12}{'factor':>8}")
+        for name in fns:
+            h, a = hot[name], arch[name]
+            print(f"{name:<26}{h:>10.2f}ms{a:>10.2f}ms{h / a if a else 0:>7.1f}x")
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# Compara con la línea base guardada para la misma suite y tamaño; devuelve
+# el número de regresiones.
+def compare(base, res, tolerance):
+    if not base:
+        print("(sin línea base para esta suite y tamaño)")
+        return 0
+    print(f"\n{'función':<26}{'base':>10}{'actual':>10}{'Δ':>8}")
+    bad = 0
+    for name, ms in res.items():
+        b = base.get(name)
+        if b is None:
+            print(f"{name:<26}{'-':>10}{ms:>8.2f}ms   nuevo")
+            continue
+        worse = ms > b * (1 + tolerance) and ms - b > 1.0
+        bad  += worse
+        print(f"{name:<26}{b:>8.2f}ms{ms:>8.2f}ms{(ms / b - 1) * 100 if b else 0:>+7.0f}%"
+              f"{'  <-- REGRESIÓN' if worse else ''}")
+    return bad
+
+SUITES = {"queries": run_queries, "pdf": run_pdf, "stress": run_stress,
+          "style": run_style, "startup": run_startup,
+          "search": run_search, "plans": run_plans, "datapath": run_datapath,
+          "fragments": run_fragments, "memory": run_memory, "archive": run_archive}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("suite", choices=SUITES)
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--users", type=int, default=GEN["n_users"], help="Residenten")
+    ap.add_argument("--seed", type=int, default=GEN["seed"])
+    ap.add_argument("--baseline", default=BASELINE, help="Datei der Vergleichsbasis")
+    ap.add_argument("--save-baseline", action="store_true",
+                    help="Ergebnisse als neue Vergleichsbasis speichern")
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = ap.parse_args()
+    GEN.update(n_users=args.users, seed=args.seed)
+
+    baseline, regressions = load_baseline(args.baseline), 0
+    for n in args.rows:
+        res = SUITES[args.suite](n, args.repeat)
+        if not isinstance(res, dict):
+            continue
+        key = f"{args.suite}/{n}/{args.users}/{args.seed}"
+        if args.save_baseline:
+            baseline[key] = {k: round(v, 3) for k, v in res.items()}
+        else:
+            regressions += compare(baseline.get(key), res, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"\nLínea base guardada en {args.baseline}")
+    elif regressions:
+        raise SystemExit(f"{regressions} regresiones frente a {args.baseline}")
+
+if __name__ == "__main__":
+    main()
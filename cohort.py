@@ -0,0 +1,91 @@
+from datetime import date
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from db import get_cur, data_version
+from profiling import cached_body, profiled
+
+# ─── ANALÍTICA DE COHORTE (TUTOR) ─────────────────────────────────────────────
+# Una sola lectura de ops_rollup (24 meses, por residente, mes y categoría); el
+# resto se calcula sobre una matriz densa residentes × meses: las ventanas móviles son
+# diferencias de sumas acumuladas y los percentiles, rangos por columna.
+WINDOWS = (3, 6, 12)
+QUANTILES = {"P25": 0.25, "P50": 0.5, "P75": 0.75, "P90": 0.9}
+TREND_QUANTILES = ["P25", "P50", "P75"]
+
+class Cohort(NamedTuple):
+    residents:   pd.DataFrame   # una fila por residente
+    percentiles: pd.DataFrame   # QUANTILES × métricas de `residents`
+    ratio_trend: pd.DataFrame   # 12 meses del año × TREND_QUANTILES (% Operateur, 12M)
+
+def _rolling(mat, w):
+    # Suma de los últimos w meses en cada columna (mes) de una matriz densa.
+    c = np.cumsum(mat, axis=1)
+    out = c.copy()
+    out[:, w:] -= c[:, :-w]
+    return out
+
+@st.cache_data(max_entries=64, show_spinner=False)
+@cached_body
+def _q_cohort(year, goals, ver):
+    goals = dict(goals)
+    today = date.today()
+    # Mes de referencia: diciembre del año o el mes actual si el año está en
+    # curso. Bastan 24 meses: 12M actuales y los de hace un año para la tendencia.
+    ref   = year * 12 + 11 if year < today.year else today.year * 12 + today.month - 1
+    first = ref - 23
+    cur   = get_cur()
+    rows  = cur.execute("""
+        SELECT username, jahr * 12 + monat - 1 AS mi, kategorie,
+               SUM(n), SUM(CASE WHEN rolle='Operateur' THEN n ELSE 0 END)
+        FROM ops_rollup
+        WHERE jahr BETWEEN ? AND ? AND jahr * 12 + monat - 1 BETWEEN ? AND ?
+          AND username != ''
+        GROUP BY username, mi, kategorie""",
+        (first // 12, ref // 12, first, ref)).fetchall()
+    users = sorted({r[0] for r in cur.execute("SELECT username FROM users")}
+                   | {r[0] for r in rows})
+    df    = pd.DataFrame(rows, columns=["user", "mi", "kat", "n", "op"]).astype(
+        {"mi": int, "n": int, "op": int})
+
+    # Matrices densas residentes × 24 meses (casos y Operateur).
+    ui   = pd.Index(users)
+    r, c = ui.get_indexer(df["user"]), (df["mi"] - first).to_numpy()
+    n_m  = np.zeros((len(users), 24)); op_m = np.zeros_like(n_m)
+    np.add.at(n_m, (r, c), df["n"].to_numpy())
+    np.add.at(op_m, (r, c), df["op"].to_numpy())
+
+    res = pd.DataFrame(index=ui.rename("Benutzer"))
+    yr  = df[df["mi"] // 12 == year]
+    per_kat = (yr.groupby(["user", "kat"])["n"].sum().unstack()
+                 .reindex(index=ui, columns=list(goals)).fillna(0).astype(int))
+    res[list(goals)] = per_kat.to_numpy()
+    res["Ziel %"] = np.mean([np.minimum(res[k] / g, 1.0) for k, g in goals.items() if g],
+                            axis=0) * 100
+    yr_n, yr_op = yr.groupby("user")["n"].sum(), yr.groupby("user")["op"].sum()
+    res["Operateur %"] = (yr_op / yr_n).reindex(ui).values * 100
+
+    for w in WINDOWS:
+        res[f"{w}M / Monat"] = _rolling(n_m, w)[:, -1] / w
+    n12, op12 = _rolling(n_m, 12), _rolling(op_m, 12)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share12 = np.where(n12 > 0, op12 / n12 * 100, np.nan)
+    res["Operateur % Δ12M"] = share12[:, -1] - share12[:, -13]
+    res["Perzentil 12M"] = res["12M / Monat"].rank(pct=True) * 100
+
+    pct = res.drop(columns=list(goals) + ["Perzentil 12M"]).quantile(list(QUANTILES.values()))
+    pct.index = list(QUANTILES)
+
+    # Reparto Operateur (12 meses móviles) de la cohorte en cada mes del año;
+    # los meses posteriores a `ref` quedan vacíos.
+    trend = pd.DataFrame(share12).reindex(columns=[year * 12 + m - first for m in range(12)])
+    trend = trend.quantile([QUANTILES[q] for q in TREND_QUANTILES]).T
+    trend.index, trend.columns = range(1, 13), TREND_QUANTILES
+    return Cohort(res.reset_index(), pct, trend)
+
+@profiled("sql")
+def fetch_cohort(year, goals):
+    return _q_cohort(int(year), tuple(goals.items()), data_version(None))
@@ -0,0 +1,1176 @@
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import accumulate, chain, islice
+from operator import itemgetter
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from katalog import EINGRIFFE, KATEGORIEN, ROLLEN, VERSCHLUSSSYSTEM, ZUGAENGE
+from profiling import cached_body, profiled
+
+DB_PATH = os.environ.get("LOGBUCH_DB", "chirurgischer_bericht.db")
+BUSY_TIMEOUT_MS = 5000
+
+# ─── MIGRACIONES ──────────────────────────────────────────────────────────────
+# Cada paso lleva el esquema de la versión i a la i+1 (PRAGMA user_version).
+# Los pasos nuevos se añaden al final de MIGRATIONS; nunca se reordenan.
+def _mig_indices(cur):
+    # (username, datum_sort, kategorie) cubre el dashboard por año y usuario,
+    # (username, user_id) el Logbuch ordenado y el borrado/renumeración,
+    # (datum_sort, kategorie) el Monatsverlauf del tutor.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_user_datum "
+                "ON operationen(username, datum_sort, kategorie)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_user_uid "
+                "ON operationen(username, user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_datum "
+                "ON operationen(datum_sort, kategorie)")
+    cur.execute("ANALYZE")
+
+# Resumen (username, jahr, monat, kategorie, rolle) -> n mantenido por triggers,
+# de modo que KPIs, Monatsverlauf y ranking leen unos cientos de filas en lugar
+# de agregar operationen completa. Los NULL se guardan como '' / 0. La clave se
+# calcula de las columnas de texto (esquema hasta la versión 5) o de las claves
+# del esquema compacto (_ROLLUP_KEY, migración 6).
+_ROLLUP_KEY_TEXT = """COALESCE({t}.username,''),
+    COALESCE(CAST(substr({t}.datum_sort,1,4) AS INTEGER),0),
+    COALESCE(CAST(substr({t}.datum_sort,6,2) AS INTEGER),0),
+    COALESCE({t}.kategorie,''), COALESCE({t}.rolle,'')"""
+_ROLLUP_KEY = """COALESCE((SELECT username FROM users WHERE id = {t}.benutzer_id),''),
+    {t}.datum / 10000, {t}.datum / 100 % 100,
+    COALESCE((SELECT name FROM kategorien WHERE id = {t}.kategorie_id),''),
+    COALESCE((SELECT name FROM rollen WHERE id = {t}.rolle_id),'')"""
+_ROLLUP_COLS = "username, jahr, monat, kategorie, rolle"
+
+def _rollup_add(t, key=_ROLLUP_KEY):
+    return (f"INSERT INTO ops_rollup ({_ROLLUP_COLS}, n) VALUES ({key.format(t=t)}, 1) "
+            f"ON CONFLICT ({_ROLLUP_COLS}) DO UPDATE SET n = n + 1;")
+
+def _rollup_sub(t, key=_ROLLUP_KEY):
+    key = key.format(t=t)
+    return (f"UPDATE ops_rollup SET n = n - 1 WHERE ({_ROLLUP_COLS}) = ({key});"
+            f"DELETE FROM ops_rollup WHERE ({_ROLLUP_COLS}) = ({key}) AND n <= 0;")
+
+# Se agrupa primero por las claves enteras y sólo después se resuelven los
+# nombres (unos cientos de grupos en lugar de una subconsulta por fila). Los
+# años archivados (migración 7) no están en operationen: se suman desde su
+# resumen archiv_summe. `jahr` y `bid` limitan el recálculo a un año / usuario.
+def rebuild_rollup(conn, jahr=None, bid=None):
+    p    = {"jahr": jahr, "bid": bid}
+    cond = lambda *cs: " AND ".join(["1"] + [c for c, v in zip(cs, (jahr, bid))
+                                             if v is not None])
+    conn.execute("DELETE FROM ops_rollup WHERE " + cond(
+        "jahr = :jahr", "username = COALESCE((SELECT username FROM users "
+                        "WHERE id = :bid), '')"), p)
+    ops = cond("datum BETWEEN :jahr * 10000 AND :jahr * 10000 + 9999", "benutzer_id = :bid")
+    archiv = ""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'archiv_summe'").fetchone():
+        archiv = (f"UNION ALL SELECT benutzer_id, jahr, monat, kategorie_id, rolle_id, "
+                  f"SUM(n) FROM archiv_summe WHERE {cond('jahr = :jahr', 'benutzer_id = :bid')} "
+                  f"GROUP BY 1, 2, 3, 4, 5")
+    conn.execute(f"""
+        INSERT INTO ops_rollup ({_ROLLUP_COLS}, n)
+        SELECT COALESCE(u.username,''), g.jahr, g.monat, COALESCE(k.name,''),
+               COALESCE(r.name,''), SUM(g.n)
+        FROM (SELECT benutzer_id, datum / 10000 AS jahr, datum / 100 % 100 AS monat,
+                     kategorie_id, rolle_id, COUNT(*) AS n
+              FROM operationen WHERE {ops} GROUP BY 1, 2, 3, 4, 5 {archiv}) g
+        LEFT JOIN users u      ON u.id = g.benutzer_id
+        LEFT JOIN kategorien k ON k.id = g.kategorie_id
+        LEFT JOIN rollen r     ON r.id = g.rolle_id
+        GROUP BY 1, 2, 3, 4, 5""", p)
+
+def _mig_rollup(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS ops_rollup (
+        username TEXT NOT NULL, jahr INTEGER NOT NULL, monat INTEGER NOT NULL,
+        kategorie TEXT NOT NULL, rolle TEXT NOT NULL, n INTEGER NOT NULL,
+        PRIMARY KEY (username, jahr, monat, kategorie, rolle)) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rollup_jahr ON ops_rollup(jahr, monat)")
+    key = _ROLLUP_KEY_TEXT
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_ins AFTER INSERT ON operationen
+        BEGIN {_rollup_add("NEW", key)} END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_del AFTER DELETE ON operationen
+        BEGIN {_rollup_sub("OLD", key)} END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_upd
+        AFTER UPDATE OF username, datum_sort, kategorie, rolle ON operationen
+        BEGIN {_rollup_sub("OLD", key)} {_rollup_add("NEW", key)} END;
+    """)
+    cur.execute(f"INSERT INTO ops_rollup ({_ROLLUP_COLS}, n) "
+                f"SELECT {key.format(t='operationen')}, COUNT(*) FROM operationen "
+                f"GROUP BY 1, 2, 3, 4, 5")
+
+# La paginación por (datum_sort, id) necesita datum_sort en todas las filas:
+# las antiguas sin él se rellenan a partir de datum (TT.MM.JJJJ).
+def _mig_datum_sort(cur):
+    cur.execute("""UPDATE operationen
+        SET datum_sort = substr(datum,7,4) || '-' || substr(datum,4,2) || '-' || substr(datum,1,2)
+        WHERE datum_sort IS NULL
+          AND datum GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'""")
+    cur.execute("UPDATE operationen SET datum_sort = '' WHERE datum_sort IS NULL")
+
+# Índice de texto completo sobre operationen (tabla de contenido externo: el
+# texto no se duplica). username es una columna indexada más para que el
+# filtro por residente sea parte del MATCH. Es sólo un prefiltro: el token no
+# es exacto ("alice" casa con "Alice Smith" o "Älice"), así que la búsqueda
+# comprueba además el usuario exacto de cada fila.
+FTS_COLS = "diagnose, notizen, eingriff, patient_id, username"
+
+def _mig_fts(cur):
+    new = ", ".join(f"NEW.{c.strip()}" for c in FTS_COLS.split(","))
+    old = ", ".join(f"OLD.{c.strip()}" for c in FTS_COLS.split(","))
+    delete = (f"INSERT INTO ops_fts (ops_fts, rowid, {FTS_COLS}) "
+              f"VALUES ('delete', OLD.id, {old});")
+    insert = f"INSERT INTO ops_fts (rowid, {FTS_COLS}) VALUES (NEW.id, {new});"
+    cur.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS ops_fts USING fts5(
+        {FTS_COLS}, content='operationen', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""")
+    cur.executescript(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_ins AFTER INSERT ON operationen
+        BEGIN {insert} END;
+        CREATE TRIGGER IF NOT EXISTS trg_fts_del AFTER DELETE ON operationen
+        BEGIN {delete} END;
+        CREATE TRIGGER IF NOT EXISTS trg_fts_upd
+        AFTER UPDATE OF {FTS_COLS} ON operationen
+        BEGIN {delete} {insert} END;
+    """)
+    cur.execute("INSERT INTO ops_fts (ops_fts) VALUES ('rebuild')")
+
+# Índices para los filtros de OpsFilter que no empiezan por usuario ni fecha
+# (vista de tutor); datum_sort al final sirve el orden del Logbuch.
+def _mig_filter_indices(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_eingriff "
+                "ON operationen(eingriff, datum_sort)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_rolle "
+                "ON operationen(rolle, datum_sort)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_zugang "
+                "ON operationen(zugang, verschlusssystem, datum_sort)")
+    cur.execute("ANALYZE")
+
+# ─── ESQUEMA COMPACTO (migración 6) ───────────────────────────────────────────
+# operationen guarda claves enteras en lugar de texto repetido: kategorie,
+# eingriff, rolle, zugang y verschlusssystem apuntan a tablas de consulta
+# (id, name) sembradas con el catálogo, benutzer_id a users.id y la fecha es un
+# único entero JJJJMMTT (0 = desconocida). user_id sigue siendo el número
+# correlativo del caso dentro de cada usuario. El texto (y TT.MM.JJJJ) se
+# resuelve al leer en la vista ops_view; las tablas de consulta son diminutas.
+LOOKUPS = {"kategorie": "kategorien", "eingriff": "eingriffe", "rolle": "rollen",
+           "zugang": "zugaenge", "verschlusssystem": "verschlusssysteme"}
+_USER   = "(SELECT id FROM users WHERE username=?)"
+
+def _catalogo():
+    return {"kategorie": KATEGORIEN, "rolle": ROLLEN, "zugang": ZUGAENGE,
+            "verschlusssystem": VERSCHLUSSSYSTEM,
+            "eingriff": [e for es in EINGRIFFE.values() for e in es]}
+
+_OPS_COMPACT = """(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    benutzer_id INTEGER REFERENCES users(id),
+    user_id INTEGER,
+    datum INTEGER NOT NULL DEFAULT 0,
+    kategorie_id INTEGER REFERENCES kategorien(id),
+    eingriff_id INTEGER REFERENCES eingriffe(id),
+    rolle_id INTEGER REFERENCES rollen(id),
+    zugang_id INTEGER REFERENCES zugaenge(id),
+    verschlusssystem_id INTEGER REFERENCES verschlusssysteme(id),
+    patient_id TEXT, diagnose TEXT, notizen TEXT)"""
+
+# Columnas de ops_view sobre `src` (operationen o la tabla de un año archivado).
+_OPS_VIEW_SELECT = """SELECT operationen.*,
+        CASE WHEN datum > 0 THEN printf('%02d.%02d.%04d', datum % 100,
+             datum / 100 % 100, datum / 10000) ELSE '' END AS datum_text,
+        COALESCE(k.name,'') AS kategorie, COALESCE(e.name,'') AS eingriff,
+        COALESCE(r.name,'') AS rolle, COALESCE(z.name,'') AS zugang,
+        COALESCE(v.name,'') AS verschlusssystem, u.username
+    FROM {src} AS operationen
+    LEFT JOIN users u              ON u.id = benutzer_id
+    LEFT JOIN kategorien k         ON k.id = kategorie_id
+    LEFT JOIN eingriffe e          ON e.id = eingriff_id
+    LEFT JOIN rollen r             ON r.id = rolle_id
+    LEFT JOIN zugaenge z           ON z.id = zugang_id
+    LEFT JOIN verschlusssysteme v  ON v.id = verschlusssystem_id"""
+_OPS_VIEW = ("CREATE VIEW IF NOT EXISTS ops_view AS "
+             + _OPS_VIEW_SELECT.format(src="operationen"))
+
+# Mismos nombres que los índices del esquema de texto: (benutzer_id, datum,
+# kategorie_id) para el dashboard, (benutzer_id, user_id) para el Logbuch y el
+# borrado, (datum, kategorie_id) para el tutor y los filtros de OpsFilter.
+# `schema` es main o el de un año archivado, que lleva los mismos índices.
+def _compact_indices(cur, schema="main"):
+    for name, cols in [
+        ("idx_ops_user_datum", "benutzer_id, datum, kategorie_id"),
+        ("idx_ops_user_uid",   "benutzer_id, user_id"),
+        ("idx_ops_datum",      "datum, kategorie_id"),
+        ("idx_ops_eingriff",   "eingriff_id, datum"),
+        ("idx_ops_rolle",      "rolle_id, datum"),
+        ("idx_ops_zugang",     "zugang_id, verschlusssystem_id, datum"),
+    ]:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{name} ON operationen({cols})")
+
+# ops_fts pasa a leer el texto de ops_view; los triggers sobre operationen
+# resuelven eingriff y username de sus tablas. username sigue siendo sólo el
+# prefiltro del MATCH: _q_search_ops exige además benutzer_id exacto.
+def _compact_fts(cur):
+    vals = lambda t: (f"{t}.diagnose, {t}.notizen, "
+                      f"(SELECT name FROM eingriffe WHERE id = {t}.eingriff_id), "
+                      f"{t}.patient_id, (SELECT username FROM users WHERE id = {t}.benutzer_id)")
+    delete = (f"INSERT INTO ops_fts (ops_fts, rowid, {FTS_COLS}) "
+              f"VALUES ('delete', OLD.id, {vals('OLD')});")
+    insert = f"INSERT INTO ops_fts (rowid, {FTS_COLS}) VALUES (NEW.id, {vals('NEW')});"
+    cur.execute(f"""CREATE VIRTUAL TABLE ops_fts USING fts5(
+        {FTS_COLS}, content='ops_view', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""")
+    cur.execute(f"CREATE TRIGGER trg_fts_ins AFTER INSERT ON operationen BEGIN {insert} END")
+    cur.execute(f"CREATE TRIGGER trg_fts_del AFTER DELETE ON operationen BEGIN {delete} END")
+    cur.execute(f"""CREATE TRIGGER trg_fts_upd AFTER UPDATE OF
+        diagnose, notizen, eingriff_id, patient_id, benutzer_id ON operationen
+        BEGIN {delete} {insert} END""")
+    cur.execute("INSERT INTO ops_fts (ops_fts) VALUES ('rebuild')")
+
+# Convierte la tabla de texto en su sitio. Sin executescript (que confirma la
+# transacción): si algo falla, la base queda en la versión 5 sin cambios.
+def _mig_compact(cur):
+    for feld, table in LOOKUPS.items():
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                    f"(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)")
+        cur.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)",
+                        [(v,) for v in _catalogo()[feld]])
+        cur.execute(f"INSERT OR IGNORE INTO {table} (name) SELECT DISTINCT {feld} "
+                    f"FROM operationen WHERE COALESCE({feld},'') <> ''")
+    # Casos de usuarios sin cuenta: se crean sin contraseña (no pueden entrar).
+    cur.execute("INSERT OR IGNORE INTO users (username) SELECT DISTINCT username "
+                "FROM operationen WHERE COALESCE(username,'') <> ''")
+    cur.execute(f"CREATE TABLE operationen_neu {_OPS_COMPACT}")
+    joins = "".join(f" LEFT JOIN {t} ON {t}.name = o.{f}" for f, t in LOOKUPS.items())
+    cur.execute(f"""
+        INSERT INTO operationen_neu (id, benutzer_id, user_id, datum, kategorie_id,
+            eingriff_id, rolle_id, zugang_id, verschlusssystem_id,
+            patient_id, diagnose, notizen)
+        SELECT o.id, users.id, o.user_id,
+            CASE WHEN o.datum_sort GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+                 THEN CAST(replace(substr(o.datum_sort,1,10),'-','') AS INTEGER) ELSE 0 END,
+            kategorien.id, eingriffe.id, rollen.id, zugaenge.id, verschlusssysteme.id,
+            o.patient_id, o.diagnose, o.notizen
+        FROM operationen o LEFT JOIN users ON users.username = o.username{joins}""")
+    # Con la tabla se van sus índices y triggers; ops_fts apuntaba a ella.
+    cur.execute("DROP TABLE ops_fts")
+    cur.execute("DROP TABLE operationen")
+    cur.execute("ALTER TABLE operationen_neu RENAME TO operationen")
+    _compact_indices(cur)
+    cur.execute(_OPS_VIEW)
+    cur.execute(f"CREATE TRIGGER trg_rollup_ins AFTER INSERT ON operationen "
+                f"BEGIN {_rollup_add('NEW')} END")
+    cur.execute(f"CREATE TRIGGER trg_rollup_del AFTER DELETE ON operationen "
+                f"BEGIN {_rollup_sub('OLD')} END")
+    cur.execute(f"CREATE TRIGGER trg_rollup_upd AFTER UPDATE OF "
+                f"benutzer_id, datum, kategorie_id, rolle_id ON operationen "
+                f"BEGIN {_rollup_sub('OLD')} {_rollup_add('NEW')} END")
+    rebuild_rollup(cur.connection)
+    _compact_fts(cur)
+    cur.execute("ANALYZE")
+
+# ─── ARCHIVO POR AÑOS (migración 7) ───────────────────────────────────────────
+# Los años cerrados pueden pasar a un fichero SQLite propio (archive_year). En
+# la base principal quedan el registro `archiv`, el resumen archiv_summe de cada
+# año archivado (usuario, mes, kategorie, rolle, eingriff -> n; de él salen el
+# rollup, las Top-Eingriffe y la poda de años por filtro) y archiv_benutzer con
+# el último user_id de cada usuario en cada año. Las claves NULL se guardan como
+# 0. `wartung` recuerda cuándo se hizo cada tarea periódica de maintenance.py.
+def _mig_archiv(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS archiv (
+        jahr INTEGER PRIMARY KEY, datei TEXT NOT NULL,
+        n INTEGER NOT NULL DEFAULT 0, archiviert TEXT)""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS archiv_summe (
+        benutzer_id INTEGER NOT NULL, jahr INTEGER NOT NULL, monat INTEGER NOT NULL,
+        kategorie_id INTEGER NOT NULL, rolle_id INTEGER NOT NULL,
+        eingriff_id INTEGER NOT NULL, n INTEGER NOT NULL,
+        PRIMARY KEY (benutzer_id, jahr, monat, kategorie_id, rolle_id, eingriff_id)
+        ) WITHOUT ROWID""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS archiv_benutzer (
+        benutzer_id INTEGER NOT NULL, jahr INTEGER NOT NULL,
+        n INTEGER NOT NULL, max_uid INTEGER NOT NULL,
+        PRIMARY KEY (benutzer_id, jahr)) WITHOUT ROWID""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS wartung (
+        aufgabe TEXT PRIMARY KEY, zuletzt TEXT NOT NULL)""")
+
+MIGRATIONS = [
+    _mig_indices,           # 1
+    _mig_rollup,            # 2
+    _mig_datum_sort,        # 3
+    _mig_fts,               # 4
+    _mig_filter_indices,    # 5
+    _mig_compact,           # 6
+    _mig_archiv,            # 7
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn, upto=SCHEMA_VERSION):
+    cur = conn.cursor()
+    ver = cur.execute("PRAGMA user_version").fetchone()[0]
+    for v in range(ver, upto):
+        MIGRATIONS[v](cur)
+        cur.execute(f"PRAGMA user_version={v + 1}")
+        conn.commit()
+
+# ─── BASE DE DATOS ────────────────────────────────────────────────────────────
+def _init_schema(conn, upto=SCHEMA_VERSION):
+    cur = conn.cursor()
+    # Base ya migrada: nada que comprobar (es lo habitual en cada arranque).
+    if cur.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+        return
+    cur.execute("""CREATE TABLE IF NOT EXISTS users
+        (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT,
+         security_question TEXT, security_answer TEXT)""")
+    cur.execute("PRAGMA table_info(users)")
+    user_cols = [r[1] for r in cur.fetchall()]
+    for col, sql in [
+        ("security_question", "ALTER TABLE users ADD COLUMN security_question TEXT"),
+        ("security_answer",   "ALTER TABLE users ADD COLUMN security_answer TEXT"),
+    ]:
+        if col not in user_cols:
+            cur.execute(sql)
+    cur.execute("""CREATE TABLE IF NOT EXISTS operationen (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        datum TEXT, datum_sort TEXT, eingriff TEXT, rolle TEXT,
+        patient_id TEXT, diagnose TEXT, kategorie TEXT,
+        zugang TEXT, verschlusssystem TEXT, notizen TEXT,
+        username TEXT, user_id INTEGER)""")
+    cur.execute("PRAGMA table_info(operationen)")
+    cols = [r[1] for r in cur.fetchall()]
+    for col, sql in [
+        ("zugang",           "ALTER TABLE operationen ADD COLUMN zugang TEXT"),
+        ("verschlusssystem", "ALTER TABLE operationen ADD COLUMN verschlusssystem TEXT"),
+        ("username",         "ALTER TABLE operationen ADD COLUMN username TEXT"),
+        ("datum_sort",       "ALTER TABLE operationen ADD COLUMN datum_sort TEXT"),
+        ("user_id",          "ALTER TABLE operationen ADD COLUMN user_id INTEGER"),
+    ]:
+        if col not in cols:
+            cur.execute(sql)
+    conn.commit()
+    migrate(conn, upto)
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+# Conexiones: en WAL los lectores no bloquean al escritor ni entre sí, así que
+# cada hilo de Streamlit lee con su propia conexión (threading.local) y todas
+# las escrituras pasan por una única conexión protegida por un lock.
+@st.cache_resource
+def _pool():
+    w = _connect()
+    w.execute("PRAGMA journal_mode=WAL")
+    _init_schema(w)
+    _renum_pendientes(w)
+    return {"writer": w, "lock": threading.RLock(), "local": threading.local()}
+
+def reset_pool():
+    # Para herramientas que cambian DB_PATH (benchmark, maintenance).
+    _pool.clear()
+
+def get_conn():
+    local = _pool()["local"]
+    if getattr(local, "conn", None) is None:
+        local.conn = _connect()
+    return local.conn
+
+def get_cur(): return get_conn().cursor()
+
+# Transacción de escritura serializada: commit al salir, rollback si falla.
+@contextmanager
+def writer():
+    p = _pool()
+    with p["lock"]:
+        conn = p["writer"]
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+# ─── CACHE DE AGREGADOS ───────────────────────────────────────────────────────
+# Cada usuario tiene un contador de versión compartido entre sesiones; la clave
+# None es la versión global que usan las vistas de tutor (todos los usuarios).
+# Toda escritura sobre operationen llama a invalidate(uname), así las consultas
+# cacheadas sólo se recalculan cuando cambian las filas de ese usuario.
+@st.cache_resource
+def _data_versions():
+    return {"lock": threading.Lock(), "v": defaultdict(int)}
+
+def data_version(uname):
+    return _data_versions()["v"][uname or None]
+
+def invalidate(uname):
+    s = _data_versions()
+    with s["lock"]:
+        s["v"][uname] += 1
+        s["v"][None]  += 1
+    _evict_exports(uname)
+
+# ─── CACHE DE EXPORTES ────────────────────────────────────────────────────────
+# Ficheros CSV/PDF ya generados, compartidos entre sesiones. La clave es
+# (owner, kind, firma del filtro, versión); owner es el usuario o None para las
+# vistas de tutor. Una escritura de `uname` descarta sus ficheros y los de tutor.
+EXPORT_MAX_FILES = 32
+
+@st.cache_resource
+def _export_store():
+    return {"lock": threading.Lock(), "files": {}}
+
+def export_key(owner, kind, sig):
+    return (owner, kind, sig, data_version(owner))
+
+def peek_export(owner, kind, sig):
+    s = _export_store()
+    with s["lock"]:
+        return s["files"].get(export_key(owner, kind, sig))
+
+# `key` se toma al empezar a generar el fichero (export_key); si entretanto hubo
+# una escritura el resultado ya no corresponde a los datos y se descarta.
+def store_export(key, data):
+    owner, ver = key[0], key[-1]
+    s = _export_store()
+    with s["lock"]:
+        if ver != data_version(owner):
+            return False
+        s["files"][key] = data
+        while len(s["files"]) > EXPORT_MAX_FILES:
+            s["files"].pop(next(iter(s["files"])))
+    return True
+
+def _evict_exports(uname):
+    s = _export_store()
+    with s["lock"]:
+        for key in [k for k in s["files"] if k[0] in (uname, None)]:
+            del s["files"][key]
+
+# ─── ESCRITURAS ───────────────────────────────────────────────────────────────
+# Claves de cada caso (dicts de la app y del import); datum es la fecha ISO.
+OP_FIELDS = ("datum", "eingriff", "rolle", "patient_id", "diagnose",
+             "kategorie", "zugang", "verschlusssystem", "notizen")
+_ENC_COLS = ("datum, kategorie_id, eingriff_id, rolle_id, zugang_id, "
+             "verschlusssystem_id, patient_id, diagnose, notizen")
+
+# Devuelve una función dict de caso -> valores de _ENC_COLS. Los nombres se
+# resuelven a su id una vez por llamada a _encoder; los que aún no existen en
+# la tabla de consulta se añaden (sólo pasa con valores fuera del catálogo).
+def _encoder(conn):
+    memo = {}
+    def lookup(feld, name):
+        if not name:
+            return None
+        if (feld, name) not in memo:
+            table = LOOKUPS[feld]
+            conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+            memo[feld, name] = conn.execute(f"SELECT id FROM {table} WHERE name=?",
+                                            (name,)).fetchone()[0]
+        return memo[feld, name]
+    def encode(op):
+        d = str(op.get("datum") or "")[:10]
+        return (int(d.replace("-", "")) if re.fullmatch(r"\d{4}-\d\d-\d\d", d) else 0,
+                *(lookup(f, op.get(f)) for f in
+                  ("kategorie", "eingriff", "rolle", "zugang", "verschlusssystem")),
+                op.get("patient_id", ""), op.get("diagnose", ""), op.get("notizen", ""))
+    return encode
+
+# id de users para `username`; los usuarios sin cuenta (scripts, datos
+# antiguos) se crean sin contraseña.
+def _benutzer_id(conn, username):
+    conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+    return conn.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()[0]
+
+# Último user_id del usuario (parámetro: benutzer_id dos veces) en operationen
+# y en sus años archivados; sólo lee índices y archiv_benutzer, sin ATTACH.
+_MAX_UID = ("MAX((SELECT COALESCE(MAX(user_id), 0) FROM operationen WHERE benutzer_id = ?), "
+            "(SELECT COALESCE(MAX(max_uid), 0) FROM archiv_benutzer WHERE benutzer_id = ?))")
+
+# Alta atómica: el user_id siguiente se calcula dentro del propio INSERT (MAX
+# sobre idx_ops_user_uid) y la transacción se abre con BEGIN IMMEDIATE, así dos
+# altas simultáneas, incluso desde otro proceso, nunca reciben el mismo número.
+def insert_op(username, op):
+    with writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        bid = _benutzer_id(conn, username)
+        uid = conn.execute(
+            f"INSERT INTO operationen ({_ENC_COLS}, benutzer_id, user_id) "
+            f"VALUES (?,?,?,?,?,?,?,?,?, ?, {_MAX_UID} + 1) RETURNING user_id",
+            _encoder(conn)(op) + (bid, bid, bid)).fetchone()[0]
+    invalidate(username)
+    return uid
+
+# Import masivo: una transacción y un executemany; los user_id continúan a
+# partir del máximo actual del usuario en el orden de `ops` (dicts OP_FIELDS).
+def bulk_insert_ops(username, ops):
+    with writer() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        bid    = _benutzer_id(conn, username)
+        encode = _encoder(conn)
+        base   = conn.execute(f"SELECT {_MAX_UID}", (bid, bid)).fetchone()[0]
+        n = conn.executemany(
+            f"INSERT INTO operationen ({_ENC_COLS}, benutzer_id, user_id) "
+            f"VALUES (?,?,?,?,?,?,?,?,?, ?, ?)",
+            (encode(op) + (bid, base + i) for i, op in enumerate(ops, 1))).rowcount
+    invalidate(username)
+    return n
+
+# Renumera user_id 1..n por orden de id (reparación). La numeración se calcula
+# una vez sobre operationen y los años archivados del usuario (los id son únicos
+# entre ficheros) y cada tabla sólo reescribe las filas cuyo número cambia.
+def reorder_ids(uname):
+    with writer() as conn:
+        bid, jahre = _benutzer_jahre(conn, uname)
+        _vor_schreiben(conn, uname, jahre)
+        _renumerar(conn, bid, jahre)
+        conn.execute("DELETE FROM wartung WHERE aufgabe = ?", (_RENUM + uname,))
+    invalidate(uname)
+
+# Cuerpo de reorder_ids, también para reparar una renumeración pendiente.
+def _renumerar(conn, bid, jahre):
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS renum (id INTEGER PRIMARY KEY, rn INTEGER)")
+    conn.execute("DELETE FROM temp.renum")
+    ids = "INSERT INTO temp.renum (id) SELECT id FROM {} WHERE benutzer_id = ?"
+    conn.execute(ids.format("main.operationen"), (bid,))
+    for lote in _lotes(conn, jahre):
+        for j in lote:
+            conn.execute(ids.format(f"archiv_{j}.operationen"), (bid,))
+    conn.execute("UPDATE temp.renum SET rn = x.rn FROM (SELECT id, ROW_NUMBER() "
+                 "OVER (ORDER BY id) AS rn FROM temp.renum) x WHERE renum.id = x.id")
+    renum = ("UPDATE {} SET user_id = r.rn FROM temp.renum r "
+             "WHERE operationen.id = r.id AND operationen.user_id IS NOT r.rn")
+    conn.execute(renum.format("main.operationen"))
+    for lote in _lotes(conn, jahre):
+        for j in lote:
+            conn.execute(renum.format(f"archiv_{j}.operationen"))
+            _archiv_summen(conn, j, bid)
+
+# Borra varias entradas de un usuario en una transacción y desplaza los user_id
+# siguientes en la misma sentencia: cada fila baja tantas posiciones como IDs
+# borrados tenga por debajo, así la numeración sigue siendo 1..n sin huecos.
+# Los años archivados del usuario se tratan igual; como sus ficheros no tienen
+# triggers del rollup, su resumen y su rollup se recalculan después.
+def delete_ops(uname, user_ids):
+    ids = sorted({int(i) for i in user_ids})
+    if not ids:
+        return 0
+    def borrar(t):
+        k = conn.execute(
+            f"DELETE FROM {t} WHERE benutzer_id = ? "
+            "AND user_id IN (SELECT value FROM json_each(?))",
+            (bid, json.dumps(ids))).rowcount
+        conn.execute(
+            f"UPDATE {t} SET user_id = user_id - "
+            "(SELECT COUNT(*) FROM json_each(?2) WHERE value < operationen.user_id) "
+            "WHERE benutzer_id = ?1 AND user_id > ?3",
+            (bid, json.dumps(ids), ids[0]))
+        return k
+    with writer() as conn:
+        bid, jahre = _benutzer_jahre(conn, uname)
+        _vor_schreiben(conn, uname, jahre)
+        n = borrar("operationen")
+        for lote in _lotes(conn, jahre):
+            for jahr in lote:
+                k = borrar(f"archiv_{jahr}.operationen")
+                n += k
+                _archiv_summen(conn, jahr, bid)
+                if k:
+                    rebuild_rollup(conn, jahr, bid)
+        conn.execute("DELETE FROM wartung WHERE aufgabe = ?", (_RENUM + uname,))
+    invalidate(uname)
+    return n
+
+# ─── ARCHIVO ──────────────────────────────────────────────────────────────────
+# Cada año archivado es un fichero <base>_<jahr>.db junto a la base principal
+# con la misma tabla operationen (mismos id, user_id e índices; las claves de
+# las tablas de consulta siguen resolviéndose en la principal). Se adjunta
+# como archiv_<jahr> cuando una consulta lo necesita y sigue adjunto en esa
+# conexión; SQLite admite pocas bases adjuntas, así que por encima de
+# ARCHIV_ATTACH_MAX se suelta la adjuntada hace más tiempo. Las lecturas
+# recorren los años de uno en uno; borrar y renumerar los recorren en lotes de
+# hasta ARCHIV_ATTACH_MAX años adjuntos a la vez (_lotes).
+# Un alta con fecha de un año ya archivado queda en operationen, así que las
+# consultas leen siempre operationen más los años archivados que toquen.
+ARCHIV_ATTACH_MAX = 8
+
+_OPS_ARCHIV = re.sub(r" REFERENCES \w+\(id\)| AUTOINCREMENT", "", _OPS_COMPACT)
+
+def archiv_pfad(jahr):
+    base, ext = os.path.splitext(os.path.abspath(DB_PATH))
+    return f"{base}_{jahr}{ext or '.db'}"
+
+def _adjuntos(conn):
+    return [r[1] for r in conn.execute("PRAGMA database_list") if r[1].startswith("archiv_")]
+
+def _attach(conn, *jahre, neu=False):
+    if len(jahre) > ARCHIV_ATTACH_MAX:
+        raise sqlite3.OperationalError(f"Zu viele Archivjahre auf einmal: {len(jahre)}")
+    have = _adjuntos(conn)
+    need = [j for j in jahre if f"archiv_{j}" not in have]
+    free = [s for s in have if int(s[7:]) not in jahre]
+    for s in free[:max(len(have) + len(need) - ARCHIV_ATTACH_MAX, 0)]:
+        conn.execute(f"DETACH {s}")
+    for j in need:
+        path = archiv_pfad(j)
+        if not neu and not os.path.exists(path):    # ATTACH crearía uno vacío
+            raise FileNotFoundError(f"Archivdatei fehlt: {path}")
+        conn.execute(f"ATTACH ? AS archiv_{j}", (path,))
+        # Como la principal (_connect); con FULL cada transacción de escritura
+        # de la conexión, aunque no toque el archivo, espera a su fsync.
+        conn.execute(f"PRAGMA archiv_{j}.synchronous=NORMAL")
+
+# Tabla de un año archivado (None = operationen), adjuntando su fichero.
+def _tabelle(conn, jahr):
+    if jahr is None:
+        return "operationen"
+    _attach(conn, jahr)
+    return f"archiv_{jahr}.operationen"
+
+# Lo mismo con las columnas de texto de ops_view.
+def _view(t):
+    return "ops_view" if t == "operationen" else f"({_OPS_VIEW_SELECT.format(src=t)})"
+
+# Años archivados que pueden tener filas del filtro (en orden) -> filas según
+# archiv_summe. Poda por el rango de fechas (en años), usuario, kategorie, rolle
+# y eingriff; zugang y verschlusssystem no están en el resumen. Sin ATTACH.
+def _archiv_jahre(conn, username, is_tutor, flt):
+    flt   = flt or NO_FILTER
+    conds = ["jahr BETWEEN ? AND ?"]
+    p     = (int((flt.von or "0")[:4]), int((flt.bis or "9999")[:4]))
+    for sql, val in [
+        (f"benutzer_id = {_USER}", flt.benutzer if is_tutor else username),
+        *((f"{f}_id = (SELECT id FROM {LOOKUPS[f]} WHERE name=?)", getattr(flt, f))
+          for f in ("kategorie", "rolle", "eingriff")),
+    ]:
+        if val:
+            conds.append(sql); p += (val,)
+    return dict(conn.execute(f"SELECT jahr, SUM(n) FROM archiv_summe WHERE "
+                             f"{' AND '.join(conds)} GROUP BY jahr ORDER BY jahr", p).fetchall())
+
+# Usuario y sus años archivados (escrituras).
+def _benutzer_jahre(conn, uname):
+    row   = conn.execute("SELECT id FROM users WHERE username=?", (uname,)).fetchone()
+    bid   = row and row[0]
+    jahre = [j for j, in conn.execute("SELECT jahr FROM archiv_benutzer WHERE benutzer_id = ? "
+                                      "ORDER BY jahr", (bid,))]
+    return bid, jahre
+
+# Borrar y renumerar adjuntan el primer lote de años antes de escribir nada:
+# ATTACH no puede ir dentro de una transacción, y así con hasta
+# ARCHIV_ATTACH_MAX años el trabajo entero es una sola transacción. Con más,
+# cada lote siguiente confirma lo anterior (_lotes); por eso la primera
+# transacción deja en wartung la marca _RENUM del usuario y la última la
+# borra. Si el trabajo se corta entre lotes, la marca queda y _pool vuelve a
+# numerar a ese usuario al abrir la base (_renum_pendientes): la numeración
+# queda 1..n, aunque un borrado cortado sólo se haya hecho en parte.
+_RENUM = "renumerar:"
+
+def _vor_schreiben(conn, uname, jahre):
+    _attach(conn, *jahre[:ARCHIV_ATTACH_MAX])
+    if len(jahre) > ARCHIV_ATTACH_MAX:
+        conn.execute("INSERT INTO wartung (aufgabe, zuletzt) VALUES (?, datetime('now')) "
+                     "ON CONFLICT (aufgabe) DO UPDATE SET zuletzt = excluded.zuletzt",
+                     (_RENUM + uname,))
+
+def _renum_pendientes(conn):
+    for aufgabe, in conn.execute("SELECT aufgabe FROM wartung WHERE aufgabe LIKE ?",
+                                 (_RENUM + "%",)).fetchall():
+        bid, jahre = _benutzer_jahre(conn, aufgabe[len(_RENUM):])
+        _renumerar(conn, bid, jahre)
+        conn.execute("DELETE FROM wartung WHERE aufgabe = ?", (aufgabe,))
+        conn.commit()
+
+# Recorre `jahre` en lotes que caben adjuntos a la vez; antes de adjuntar un
+# lote que no lo está se confirma lo escrito (ver _vor_schreiben).
+def _lotes(conn, jahre):
+    for i in range(0, len(jahre), ARCHIV_ATTACH_MAX):
+        lote = jahre[i:i + ARCHIV_ATTACH_MAX]
+        if not set(_adjuntos(conn)).issuperset(f"archiv_{j}" for j in lote):
+            conn.commit()
+            _attach(conn, *lote)
+        yield lote
+
+# Recalcula archiv_summe y archiv_benutzer de un año archivado (o sólo de un
+# usuario en él) desde su fichero, ya adjuntado.
+def _archiv_summen(conn, jahr, bid=None):
+    w = "" if bid is None else " AND benutzer_id = :bid"
+    p = {"jahr": jahr, "bid": bid}
+    for t in ("archiv_summe", "archiv_benutzer"):
+        conn.execute(f"DELETE FROM {t} WHERE jahr = :jahr{w}", p)
+    conn.execute(f"""
+        INSERT INTO archiv_summe (benutzer_id, jahr, monat, kategorie_id, rolle_id,
+                                  eingriff_id, n)
+        SELECT COALESCE(benutzer_id, 0), :jahr, datum / 100 % 100, COALESCE(kategorie_id, 0),
+               COALESCE(rolle_id, 0), COALESCE(eingriff_id, 0), COUNT(*)
+        FROM archiv_{jahr}.operationen WHERE 1{w} GROUP BY 1, 3, 4, 5, 6""", p)
+    conn.execute(f"""
+        INSERT INTO archiv_benutzer (benutzer_id, jahr, n, max_uid)
+        SELECT COALESCE(benutzer_id, 0), :jahr, COUNT(*), MAX(user_id)
+        FROM archiv_{jahr}.operationen WHERE 1{w} GROUP BY 1""", p)
+    conn.execute("UPDATE archiv SET n = (SELECT COALESCE(SUM(n), 0) FROM archiv_benutzer "
+                 "WHERE jahr = :jahr) WHERE jahr = :jahr", p)
+
+# Índice de texto de un año archivado, dentro de su fichero: una tabla FTS5
+# normal (guarda su texto; ops_view no está en el fichero) con las columnas de
+# búsqueda pero sin username, el residente se acota por benutzer_id exacto. Un
+# trigger del propio fichero la sigue en los borrados. Indexa las filas que aún
+# no tiene, así también completa los ficheros archivados antes que el índice.
+_FTS_ARCHIV = "diagnose, notizen, eingriff, patient_id"
+
+def _archiv_fts(conn, jahr):
+    s = f"archiv_{jahr}"
+    conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {s}.ops_fts USING fts5("
+                 f"{_FTS_ARCHIV}, tokenize='unicode61 remove_diacritics 2')")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS {s}.trg_fts_del AFTER DELETE ON operationen "
+                 f"BEGIN DELETE FROM ops_fts WHERE rowid = OLD.id; END")
+    return conn.execute(
+        f"INSERT INTO {s}.ops_fts (rowid, {_FTS_ARCHIV}) SELECT id, {_FTS_ARCHIV} "
+        f"FROM {_view(s + '.operationen')} WHERE id NOT IN (SELECT rowid FROM {s}.ops_fts)"
+        ).rowcount
+
+# Indexa un año archivado que aún no tiene (o no entero) su ops_fts.
+def index_archive(jahr):
+    with writer() as conn:
+        _attach(conn, jahr)
+        return _archiv_fts(conn, jahr)
+
+# Mueve las filas de `jahr` de operationen a su fichero (que se crea la primera
+# vez; si ya existe, se añaden las altas posteriores) en una transacción. Los
+# triggers de borrado descuentan esas filas del rollup y de ops_fts; el rollup
+# del año se recalcula al final desde archiv_summe y el texto pasa al ops_fts
+# del fichero. El contenido de las consultas no cambia. Devuelve las filas.
+def archive_year(jahr):
+    s, cols = f"archiv_{jahr}", f"id, benutzer_id, user_id, {_ENC_COLS}"
+    rango   = (jahr * 10000, jahr * 10000 + 9999)
+    with writer() as conn:
+        _attach(conn, jahr, neu=True)
+        conn.execute(f"PRAGMA {s}.journal_mode=WAL")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {s}.operationen {_OPS_ARCHIV}")
+        _compact_indices(conn, s)
+        conn.execute("BEGIN IMMEDIATE")
+        n = conn.execute(f"INSERT INTO {s}.operationen ({cols}) SELECT {cols} "
+                         f"FROM operationen WHERE datum BETWEEN ? AND ?", rango).rowcount
+        _archiv_fts(conn, jahr)
+        conn.execute("DELETE FROM operationen WHERE datum BETWEEN ? AND ?", rango)
+        # El borrado masivo deja ops_fts llena de tombstones: se compacta ya.
+        conn.execute("INSERT INTO ops_fts (ops_fts) VALUES ('optimize')")
+        conn.execute("INSERT INTO archiv (jahr, datei, archiviert) VALUES (?, ?, date('now')) "
+                     "ON CONFLICT (jahr) DO UPDATE SET archiviert = excluded.archiviert",
+                     (jahr, os.path.basename(archiv_pfad(jahr))))
+        _archiv_summen(conn, jahr)
+        rebuild_rollup(conn, jahr)
+    return n
+
+def archived_years():
+    return [j for j, in get_cur().execute("SELECT jahr FROM archiv ORDER BY jahr")]
+
+# ─── QUERIES ──────────────────────────────────────────────────────────────────
+# Columnas del Logbuch por vista: (columna de ops_view, encabezado).
+OPS_COLS = {
+    False: [("user_id", "ID"), ("datum_text", "Datum"), ("eingriff", "Eingriff"),
+            ("rolle", "Rolle"), ("patient_id", "Patient"), ("diagnose", "Diagnose"),
+            ("kategorie", "Kategorie"), ("zugang", "Zugang"),
+            ("verschlusssystem", "Verschlusssystem"), ("notizen", "Notizen")],
+    True:  [("datum_text", "Datum"), ("eingriff", "Eingriff"), ("rolle", "Rolle"),
+            ("patient_id", "Patient"), ("kategorie", "Kategorie"),
+            ("username", "Benutzer")],
+}
+
+# ─── FILTROS ──────────────────────────────────────────────────────────────────
+# Filtro estructurado del Logbuch. Es una tupla: sirve tal cual como clave de
+# caché (st.cache_data, exportes) y se compila siempre al mismo SQL. Las fechas
+# son ISO (inclusive).
+class OpsFilter(NamedTuple):
+    kategorie:        str | None = None
+    rolle:            str | None = None
+    benutzer:         str | None = None   # sólo en la vista de tutor
+    von:              str | None = None
+    bis:              str | None = None
+    eingriff:         str | None = None
+    zugang:           str | None = None
+    verschlusssystem: str | None = None
+
+    # Sólo igualdades y rangos sobre las claves enteras, en el orden de los
+    # índices: benutzer_id + datum (idx_ops_user_datum), datum (idx_ops_datum)
+    # y eingriff / rolle / zugang + verschlusssystem con datum. Cada nombre se
+    # traduce a su id con una subconsulta constante, que el planificador usa
+    # como valor de búsqueda en el índice más selectivo.
+    def compile(self, username, is_tutor):
+        user = self.benutzer if is_tutor else username
+        day  = lambda iso: iso and int(iso.replace("-", ""))
+        conds, p = [], ()
+        for sql, val in [
+            (f"benutzer_id = {_USER}", user),
+            ("datum >= ?",            day(self.von)),
+            ("datum <= ?",            day(self.bis)),
+            *((f"{f}_id = (SELECT id FROM {t} WHERE name=?)", getattr(self, f))
+              for f, t in LOOKUPS.items()),
+        ]:
+            if val:
+                conds.append(sql); p += (val,)
+        return conds, p
+
+NO_FILTER = OpsFilter()
+
+# `src` es ops_view (columnas de texto) u operationen cuando basta con las claves
+# (COUNT): el filtro compilado sólo usa columnas de la tabla.
+def _ops_sql(select, username, is_tutor, flt, extra_conds=(), extra_p=(), src="ops_view"):
+    conds, p = (flt or NO_FILTER).compile(username, is_tutor)
+    conds, p = conds + list(extra_conds), p + tuple(extra_p)
+    sql = f"SELECT {select} FROM {src}"
+    if conds: sql += " WHERE " + " AND ".join(conds)
+    return sql, p
+
+# ─── CARGA COLUMNAR ───────────────────────────────────────────────────────────
+# fetch_ops lee las claves de operationen (sin pasar por ops_view) en bloques de
+# FETCH_BATCH filas y llena un array tipado por columna: las claves de las
+# tablas de consulta pasan a códigos de un Categorical (un único str por
+# nombre), datum a datetime64 y el texto libre a object con los valores
+# repetidos compartidos. Nunca existen la lista de tuplas de fetchall ni un str
+# por celda de Kategorie/Rolle/Eingriff/Benutzer. El texto libre sólo recuerda
+# hasta TEXT_MEMO_MAX valores por columna (Diagnose y Notizen se repiten mucho,
+# Patient casi nunca: recordarlo entero costaría más de lo que ahorra).
+# La app no la usa: el Logbuch pagina con fetch_ops_page y los exportes y el
+# PDF recorren iter_ops por bloques. Es el DataFrame entero para scripts de
+# análisis y para benchmark.py (suites datapath y memory).
+FETCH_BATCH   = 5000
+TEXT_MEMO_MAX = 10000
+
+# Encabezado -> (columna de operationen, tipo): "int", "datum", "text" o la
+# tabla de consulta cuyo nombre da la categoría.
+_FETCH_COLS = {
+    "ID":               ("user_id", "int"),
+    "Datum":            ("datum", "datum"),
+    "Eingriff":         ("eingriff_id", "eingriffe"),
+    "Rolle":            ("rolle_id", "rollen"),
+    "Patient":          ("patient_id", "text"),
+    "Diagnose":         ("diagnose", "text"),
+    "Kategorie":        ("kategorie_id", "kategorien"),
+    "Zugang":           ("zugang_id", "zugaenge"),
+    "Verschlusssystem": ("verschlusssystem_id", "verschlusssysteme"),
+    "Notizen":          ("notizen", "text"),
+    "Benutzer":         ("benutzer_id", "users"),
+}
+
+def _batch_array(col, kind, memo):
+    if kind == "text":
+        add = memo.setdefault if len(memo) < TEXT_MEMO_MAX else memo.get
+        return np.fromiter((add(v, v) for v in col), object, len(col))
+    return np.fromiter(col, np.int64 if kind == "int" else np.int32, len(col))
+
+# JJJJMMTT -> datetime64 sin pasar por texto; 0 (fecha desconocida) -> NaT.
+def _datum_array(d):
+    out = ((d // 10000 - 1970).astype("M8[Y]") + (d // 100 % 100 - 1).astype("m8[M]")
+           ).astype("M8[D]") + (d % 100 - 1).astype("m8[D]")
+    out[d <= 0] = np.datetime64("NaT")
+    return out.astype("M8[ns]")
+
+# Códigos por id leídos después del SELECT: todo id visto ya tiene su fila.
+# Sin valor (id 0) las tablas de consulta dan "", como COALESCE(name,'') en
+# ops_view; sólo Benutzer queda vacío (NaN), igual que u.username.
+def _categorical(cur, table, ids):
+    name  = "username" if table == "users" else "name"
+    pairs = cur.execute(f"SELECT id, {name} FROM {table} WHERE {name} IS NOT NULL "
+                        f"ORDER BY id").fetchall()
+    cats  = [n for _, n in pairs]
+    codes = np.full(max([i for i, _ in pairs] + [int(ids.max(initial=0))]) + 1, -1, np.int32)
+    codes[[i for i, _ in pairs]] = np.arange(len(pairs), dtype=np.int32)
+    codes = codes[ids]
+    if table != "users" and (codes < 0).any():
+        if "" not in cats:
+            cats.append("")
+        codes[codes < 0] = cats.index("")
+    return pd.Categorical.from_codes(codes, categories=cats)
+
+@profiled("sql", cached=False)
+def fetch_ops(username, is_tutor, flt=None):
+    names = ops_headers(is_tutor)
+    cols  = [_FETCH_COLS[h] for h in names]
+    conn  = get_conn()
+    jahre = list(_archiv_jahre(conn, username, is_tutor, flt))
+    cur   = conn.cursor()
+    parts = [[] for _ in cols]
+    memos = [{} for _ in cols]
+    for jahr in [None] + jahre:
+        sql, p = _ops_sql(",".join(c if k == "text" else f"COALESCE({c}, 0)" for c, k in cols),
+                          username, is_tutor, flt, src=_tabelle(conn, jahr))
+        if not is_tutor: sql += " ORDER BY user_id"
+        cur.execute(sql, p)
+        while rows := cur.fetchmany(FETCH_BATCH):
+            for part, col, (_, kind), memo in zip(parts, zip(*rows), cols, memos):
+                part.append(_batch_array(col, kind, memo))
+    data = {}
+    for i, (h, (_, kind)) in enumerate(zip(names, cols)):
+        part, parts[i] = parts[i], None     # cada bloque se libera tras unirlo
+        arr = np.concatenate(part) if part else _batch_array((), kind, {})
+        del part
+        if kind == "datum":
+            arr = _datum_array(arr)
+        elif kind not in ("int", "text"):
+            arr = _categorical(cur, kind, arr)
+        data[h] = arr
+    df = pd.DataFrame(data, copy=False)
+    # Cada tabla sale ordenada por ID, pero los user_id se reparten entre años.
+    if jahre and not is_tutor:
+        df = df.sort_values("ID", kind="stable", ignore_index=True)
+    return df
+
+def ops_headers(is_tutor):
+    return [h for _, h in OPS_COLS[is_tutor]]
+
+# Lee las filas filtradas del cursor en bloques de `chunk` (exportes grandes).
+# Con años archivados se mezclan las tablas por la clave de orden: para el
+# tutor, (datum, id) de operationen con los años seguidos (cada fichero es un
+# solo año); para un residente, cuyos user_id se reparten entre años, todas sus
+# filas ordenadas en memoria por la primera columna (son las de una persona).
+def iter_ops(username, is_tutor, flt=None, chunk=2000):
+    conn  = get_conn()
+    jahre = list(_archiv_jahre(conn, username, is_tutor, flt))
+    cols  = ",".join(c for c, _ in OPS_COLS[is_tutor])
+    order = "datum, id" if is_tutor else "user_id"
+    if not jahre:
+        sql, p = _ops_sql(cols, username, is_tutor, flt)
+        cur = conn.cursor()
+        cur.execute(sql + f" ORDER BY {order}", p)
+        while rows := cur.fetchmany(chunk):
+            yield rows
+        return
+    extra = ", datum, id" if is_tutor else ""
+    def rows(jahr):
+        sql, p = _ops_sql(cols + extra, username, is_tutor, flt,
+                          src=_view(_tabelle(conn, jahr)))
+        return conn.execute(sql + f" ORDER BY {order}", p)
+    tablas = chain([None], jahre)
+    if is_tutor:
+        merged = heapq.merge(rows(next(tablas)), chain.from_iterable(map(rows, tablas)),
+                             key=itemgetter(-2, -1))
+    else:
+        merged = iter(sorted(chain.from_iterable(map(rows, tablas)), key=itemgetter(0)))
+    while batch := list(islice(merged, chunk)):
+        yield [r[:-2] for r in batch] if is_tutor else batch
+
+# Paginación keyset sobre (datum, id): `after` es la clave de la última
+# fila de la página anterior (None = primera página). Devuelve el DataFrame de
+# la página y la clave para pedir la siguiente (None si no hay más). Cada año
+# archivado aporta como mucho una página; los anteriores a `after` se saltan y,
+# en cuanto la página se llena con fechas previas a un año, ya no se leen más.
+@st.cache_data(max_entries=512, show_spinner=False)
+@cached_body
+def _q_ops_page(username, is_tutor, flt, after, limit, ver):
+    conn  = get_conn()
+    cols  = OPS_COLS[is_tutor]
+    jahre = [j for j in _archiv_jahre(conn, username, is_tutor, flt)
+             if not after or j >= after[0] // 10000]
+    rows  = []
+    for jahr in [None] + jahre:
+        if jahr and len(rows) > limit and rows[limit][-2] < jahr * 10000:
+            break
+        sql, p = _ops_sql(f"{','.join(c for c, _ in cols)}, datum, id",
+                          username, is_tutor, flt,
+                          ["(datum, id) > (?, ?)"] if after else [], after or (),
+                          src=_view(_tabelle(conn, jahr)))
+        rows += conn.execute(sql + " ORDER BY datum, id LIMIT ?", p + (limit + 1,)).fetchall()
+        if jahr:
+            rows = sorted(rows, key=lambda r: r[-2:])[:limit + 1]
+    nxt   = tuple(rows[limit - 1][-2:]) if len(rows) > limit else None
+    names = [h for _, h in cols]
+    rows  = [r[:-2] for r in rows[:limit]]
+    return (pd.DataFrame(rows, columns=names) if rows else pd.DataFrame(columns=names)), nxt
+
+@profiled("sql")
+def fetch_ops_page(username, is_tutor, flt=None, after=None, limit=50):
+    return _q_ops_page(username, is_tutor, flt or NO_FILTER,
+                       tuple(after) if after else None, limit,
+                       data_version(None if is_tutor else username))
+
+# Los años archivados que el filtro cubre enteros (sin zugang/verschlusssystem
+# y sin cortar el año por las fechas) se cuentan con archiv_summe, sin ATTACH.
+@st.cache_data(max_entries=512, show_spinner=False)
+@cached_body
+def _q_count_ops(username, is_tutor, flt, ver):
+    conn = get_conn()
+    n    = 0
+    for jahr, summe in [(None, None), *_archiv_jahre(conn, username, is_tutor, flt).items()]:
+        if jahr and not (flt.zugang or flt.verschlusssystem) \
+                and (flt.von or "") <= f"{jahr}-01-01" and (flt.bis or "9") >= f"{jahr}-12-31":
+            n += summe
+            continue
+        sql, p = _ops_sql("COUNT(*)", username, is_tutor, flt, src=_tabelle(conn, jahr))
+        n += conn.execute(sql, p).fetchone()[0]
+    return n
+
+@profiled("sql")
+def count_ops(username, is_tutor, flt=None):
+    return _q_count_ops(username, is_tutor, flt or NO_FILTER,
+                        data_version(None if is_tutor else username))
+
+# ─── BÚSQUEDA DE TEXTO ────────────────────────────────────────────────────────
+# El texto del usuario se reduce a palabras y cada una se busca como prefijo
+# ("herz" encuentra "Herzinsuffizienz") en las columnas de texto; así nunca
+# llega sintaxis FTS5 cruda. username sólo se usa para acotar al residente.
+def _fts_query(text, username=None):
+    words = re.findall(r"\w+", text)
+    if not words:
+        return ""
+    match = "{diagnose notizen eingriff patient_id} : (" + \
+            " ".join(f'"{w}"*' for w in words) + ")"
+    if username:
+        match = f'username : "{username.replace(chr(34), chr(34) * 2)}" AND {match}'
+    return match
+
+# Resultados por relevancia (bm25) y paginados por desplazamiento. bm25 puntúa
+# todos los aciertos, así que con más de SEARCH_RANK_MAX (términos que salen en
+# casi todas las filas) se ordena por lo más reciente, que FTS5 recorre sin
+# puntuar. Con años archivados se busca en la base principal y en el ops_fts
+# de cada año con filas del usuario. bm25 depende de las estadísticas de cada
+# índice, así que sus puntuaciones no se comparan entre ficheros: por
+# relevancia salen primero los aciertos de la base principal y luego los de
+# cada año archivado, del más reciente al más antiguo, cada bloque por su bm25
+# (la página se reparte con los aciertos exactos de cada bloque). Por lo más
+# reciente, el id es global y las primeras (page + 1) × limit filas de cada
+# índice se mezclan sin más. Devuelve (página con la columna "Treffer",
+# aciertos hasta el tope).
+SEARCH_RANK_MAX = 5000
+
+@st.cache_data(max_entries=256, show_spinner=False)
+@cached_body
+def _q_search_ops(username, is_tutor, text, page, limit, ver):
+    names = ["Treffer"] + [h for _, h in OPS_COLS[is_tutor]]
+    if not _fts_query(text):
+        return pd.DataFrame(columns=names), 0
+    conn  = get_conn()
+    cur   = conn.cursor()
+    w, p  = ("", ()) if is_tutor else (f" AND o.benutzer_id = {_USER}", (username,))
+    jahre = sorted(_archiv_jahre(conn, username, is_tutor, None), reverse=True)
+    def src(jahr):
+        if jahr is None:
+            return (f"FROM ops_fts JOIN ops_view o ON o.id = ops_fts.rowid "
+                    f"WHERE ops_fts MATCH ?{w}",
+                    (_fts_query(text, None if is_tutor else username),) + p)
+        return (f"FROM archiv_{jahr}.ops_fts JOIN {_view(_tabelle(conn, jahr))} o "
+                f"ON o.id = ops_fts.rowid WHERE ops_fts MATCH ?{w}", (_fts_query(text),) + p)
+    hits, bloques = 0, []
+    for jahr in [None] + jahre:
+        if hits > SEARCH_RANK_MAX:
+            break
+        sql, q = src(jahr)
+        k = cur.execute(f"SELECT COUNT(*) FROM (SELECT 1 {sql} LIMIT ?)",
+                        q + (SEARCH_RANK_MAX + 1 - hits,)).fetchone()[0]
+        bloques.append((jahr, k)); hits += k
+    sel  = "snippet(ops_fts, -1, '«', '»', '…', 8), " + \
+           ", ".join(f"o.{c}" for c, _ in OPS_COLS[is_tutor])
+    rows = []
+    if hits <= SEARCH_RANK_MAX:
+        skip = page * limit
+        for jahr, k in bloques:
+            if skip >= k:
+                skip -= k
+                continue
+            sql, q = src(jahr)
+            rows += cur.execute(f"SELECT {sel} {sql} ORDER BY rank LIMIT ? OFFSET ?",
+                                q + (limit - len(rows), skip)).fetchall()
+            skip = 0
+            if len(rows) == limit:
+                break
+        return pd.DataFrame(rows, columns=names), hits
+    # Sólo la base principal: la página sale directamente con OFFSET.
+    skip = 0 if jahre else page * limit
+    for jahr in [None] + jahre:
+        sql, q = src(jahr)
+        rows += cur.execute(f"""
+            SELECT ops_fts.rowid, {sel}
+            {sql} ORDER BY ops_fts.rowid DESC LIMIT ? OFFSET ?""",
+            q + ((page + 1) * limit - skip, skip)).fetchall()
+    rows.sort(key=lambda r: -r[0])
+    rows = rows[page * limit - skip:][:limit]
+    return pd.DataFrame([r[1:] for r in rows], columns=names), hits
+
+@profiled("sql")
+def search_ops(username, is_tutor, text, page=0, limit=25):
+    return _q_search_ops(username, is_tutor, text.strip(), page, limit,
+                         data_version(None if is_tutor else username))
+
+# Las funciones _q_* son las consultas reales; `ver` sólo forma parte de la
+# clave de caché (data_version del usuario o global para el tutor).
+class Dashboard(NamedTuple):
+    total:      int                     # operaciones (todos los años)
+    totals:     dict[str, int]          # kategorie -> n (todos los años)
+    roles:      dict[str, int]          # rolle -> n (todos los años)
+    monthly:    dict[str, list[int]]    # kategorie -> 12 valores del año
+    cumulative: list[int]               # acumulado mensual del año
+
+    def month(self, kat):
+        return self.monthly.get(kat, [0] * 12)
+
+# Todas las cifras del dashboard con una sola lectura del rollup. Los meses de
+# otros años se agrupan en monat=0, así salen como mucho 13 × 6 filas que se
+# reparten aquí en KPIs, metas, serie mensual y acumulado.
+@st.cache_data(max_entries=512, show_spinner=False)
+@cached_body
+def _q_dashboard(username, year, ver):
+    w, p = ("WHERE username=?", (username,)) if username else ("", ())
+    rows = get_cur().execute(
+        f"SELECT CASE WHEN jahr=? THEN monat ELSE 0 END AS m, kategorie, rolle, SUM(n) "
+        f"FROM ops_rollup {w} GROUP BY m, kategorie, rolle", (year,) + p).fetchall()
+    totals, roles, monthly = defaultdict(int), defaultdict(int), {}
+    for m, kat, rolle, n in rows:
+        totals[kat] += n; roles[rolle] += n
+        if 1 <= m <= 12:
+            monthly.setdefault(kat, [0] * 12)[m - 1] += n
+    per_month = [sum(v[m] for v in monthly.values()) for m in range(12)]
+    return Dashboard(sum(totals.values()), dict(totals), dict(roles), monthly,
+                     list(accumulate(per_month)))
+
+@profiled("sql")
+def fetch_dashboard(username, year):
+    return _q_dashboard(username, int(year), data_version(username))
+
+@st.cache_data(max_entries=64, show_spinner=False)
+@cached_body
+def _q_ranking(ver):
+    cur = get_cur()
+    cur.execute("""
+        SELECT username, SUM(n) as total,
+            SUM(CASE WHEN kategorie='Operation'    THEN n ELSE 0 END),
+            SUM(CASE WHEN kategorie='Intervention' THEN n ELSE 0 END),
+            SUM(CASE WHEN kategorie='Prozedur'     THEN n ELSE 0 END)
+        FROM ops_rollup GROUP BY username ORDER BY total DESC""")
+    return cur.fetchall()
+
+@profiled("sql")
+def fetch_ranking():
+    return _q_ranking(data_version(None))
+
+# Los años archivados entran por su resumen (archiv_summe), sin ATTACH.
+@st.cache_data(max_entries=512, show_spinner=False)
+@cached_body
+def _q_top_eingriffe(username, ver):
+    cur = get_cur()
+    cur.execute(f"""
+        SELECT e.name, r.name, g.n
+        FROM (SELECT eingriff_id, rolle_id, SUM(n) n
+              FROM (SELECT COALESCE(eingriff_id, 0) eingriff_id, COALESCE(rolle_id, 0) rolle_id,
+                           COUNT(*) n
+                    FROM operationen WHERE benutzer_id = {_USER} GROUP BY 1, 2
+                    UNION ALL
+                    SELECT eingriff_id, rolle_id, n FROM archiv_summe
+                    WHERE benutzer_id = {_USER})
+              GROUP BY 1, 2 ORDER BY n DESC LIMIT 10) g
+        LEFT JOIN eingriffe e ON e.id = g.eingriff_id
+        LEFT JOIN rollen r    ON r.id = g.rolle_id
+        ORDER BY g.n DESC""", (username, username))
+    return cur.fetchall()
+
+@profiled("sql")
+def fetch_top_eingriffe(username):
+    return _q_top_eingriffe(username, data_version(username))
@@ -0,0 +1,69 @@
+import io
+import csv
+
+# ─── EXPORTES DE DATOS ────────────────────────────────────────────────────────
+# Cada escritor consume los bloques de filas de db.iter_ops según llegan del
+# cursor, así en memoria sólo conviven un bloque y el fichero de salida.
+def _csv(headers, chunks):
+    buf = io.BytesIO()
+    txt = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+    w   = csv.writer(txt)
+    w.writerow(headers)
+    for rows in chunks:
+        w.writerows(rows)
+    txt.flush(); txt.detach()
+    return buf.getvalue()
+
+def _xlsx(headers, chunks):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Logbuch")
+    ws.append(headers)
+    for rows in chunks:
+        for row in rows:
+            ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def _arrow_batches(headers, chunks):
+    import pyarrow as pa
+    # Esquema fijo: con bloques sin valores pyarrow inferiría tipo null.
+    schema = pa.schema([(h, pa.int64() if h == "ID" else pa.string()) for h in headers])
+    def batches():
+        for rows in chunks:
+            cols = list(zip(*rows))
+            yield pa.record_batch([pa.array(c, type=f.type) for c, f in zip(cols, schema)],
+                                  schema=schema)
+    return schema, batches()
+
+def _parquet(headers, chunks):
+    import pyarrow.parquet as pq
+    schema, batches = _arrow_batches(headers, chunks)
+    buf = io.BytesIO()
+    with pq.ParquetWriter(buf, schema, compression="zstd") as w:
+        for b in batches:
+            w.write_batch(b)
+    return buf.getvalue()
+
+def _feather(headers, chunks):
+    import pyarrow as pa
+    schema, batches = _arrow_batches(headers, chunks)
+    buf = io.BytesIO()
+    with pa.ipc.new_file(buf, schema,
+                         options=pa.ipc.IpcWriteOptions(compression="zstd")) as w:
+        for b in batches:
+            w.write_batch(b)
+    return buf.getvalue()
+
+# Etiqueta -> (escritor, extensión, MIME)
+EXPORT_FORMATS = {
+    "CSV":          (_csv,     "csv",     "text/csv"),
+    "Excel (XLSX)": (_xlsx,    "xlsx",    "application/vnd.openxmlformats-"
+                                          "officedocument.spreadsheetml.sheet"),
+    "Parquet":      (_parquet, "parquet", "application/vnd.apache.parquet"),
+    "Feather":      (_feather, "feather", "application/vnd.apache.arrow.file"),
+}
+
+def export_bytes(fmt, headers, chunks):
+    return EXPORT_FORMATS[fmt][0](headers, chunks)
@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from katalog import ROLLEN, ZUGAENGE, VERSCHLUSSSYSTEM
+
+# ─── IMPORT MASIVO ────────────────────────────────────────────────────────────
+# Columnas del fichero = encabezados del exporte de residente (la columna ID se
+# ignora), de modo que un CSV/XLSX exportado se puede volver a importar.
+IMPORT_COLS = {
+    "Datum": "datum", "Eingriff": "eingriff", "Rolle": "rolle", "Patient": "patient_id",
+    "Diagnose": "diagnose", "Kategorie": "kategorie", "Zugang": "zugang",
+    "Verschlusssystem": "verschlusssystem", "Notizen": "notizen",
+}
+REQUIRED_COLS = ["Datum", "Kategorie", "Eingriff", "Rolle", "Patient", "Diagnose"]
+
+def read_import_file(name, data):
+    buf = io.BytesIO(data)
+    if name.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(buf, dtype=str)
+    else:
+        df = pd.read_csv(buf, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+    df.columns = [str(c).strip() for c in df.columns]
+    return df
+
+def _parse_dates(s):
+    # TT.MM.JJJJ como en el formulario; las celdas de fecha de Excel llegan ISO.
+    d = pd.to_datetime(s, format="%d.%m.%Y", errors="coerce")
+    iso = pd.to_datetime(s.str.slice(0, 10), format="%Y-%m-%d", errors="coerce")
+    return d.fillna(iso)
+
+# Valida todas las filas a la vez con máscaras por regla. Devuelve las filas
+# válidas ya como casos de db.OP_FIELDS (datum en ISO, ...) y un
+# informe de errores con el número de fila del fichero.
+def validate_import(df, eingriffe):
+    missing = [c for c in REQUIRED_COLS if c not in df.columns]
+    if missing:
+        raise ValueError("Fehlende Spalten: " + ", ".join(missing))
+    ops = pd.DataFrame({dst: df[src].fillna("").astype(str).str.strip()
+                        if src in df.columns else ""
+                        for src, dst in IMPORT_COLS.items()}, index=df.index)
+    dates = _parse_dates(ops["datum"])
+    pairs = pd.MultiIndex.from_tuples([(k, e) for k, es in eingriffe.items() for e in es])
+    is_iv = ops["kategorie"] == "Intervention"
+
+    rules = [
+        (dates.isna(),                                      "Datum ungültig (TT.MM.JJJJ)"),
+        (~ops["kategorie"].isin(list(eingriffe)),           "Kategorie unbekannt"),
+        (~pd.MultiIndex.from_frame(ops[["kategorie", "eingriff"]]).isin(pairs)
+         & ops["kategorie"].isin(list(eingriffe)),         "Eingriff passt nicht zur Kategorie"),
+        (~ops["rolle"].isin(ROLLEN),                        "Rolle unbekannt"),
+        (ops["patient_id"] == "",                           "Patienten-ID fehlt"),
+        (ops["diagnose"] == "",                             "Diagnose fehlt"),
+        (is_iv & ~ops["zugang"].isin(ZUGAENGE),             "Zugang fehlt/ungültig"),
+        (is_iv & (ops["zugang"] == "Punktion")
+         & ~ops["verschlusssystem"].isin(VERSCHLUSSSYSTEM), "Verschlusssystem fehlt/ungültig"),
+        (is_iv & (ops["zugang"] == "Offen")
+         & (ops["verschlusssystem"] != ""),                 "Verschlusssystem nur bei Punktion"),
+        (~is_iv & ((ops["zugang"] != "") | (ops["verschlusssystem"] != "")),
+                                                            "Zugang/Verschluss nur bei Intervention"),
+    ]
+    msgs = np.full(len(ops), "", dtype=object)
+    for mask, msg in rules:
+        msgs = np.where(mask.to_numpy(), msgs + msg + "; ", msgs)
+    bad = msgs != ""
+
+    ok = ops[~bad].copy()
+    ok["datum"] = dates[~bad].dt.strftime("%Y-%m-%d")
+    report = pd.DataFrame({
+        "Zeile":  np.flatnonzero(bad) + 2,           # +1 encabezado, +1 base 1
+        "Fehler": [m.rstrip("; ") for m in msgs[bad]],
+    })
+    return ok, report
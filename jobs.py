@@ -0,0 +1,149 @@
+import itertools
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+import streamlit as st
+
+import db
+import profiling
+
+# ─── EXPORTES EN SEGUNDO PLANO ────────────────────────────────────────────────
+# Los exportes (CSV/XLSX/…/PDF) se generan en procesos aparte: la sesión que los
+# pide sigue respondiendo y el trabajo no compite por el GIL del servidor. Del
+# pool de EXPORT_WORKERS procesos, las vistas de tutor (todo el servicio) ocupan
+# como mucho TUTOR_SLOTS; el resto de sus trabajos espera en cola, así siempre
+# queda un proceso libre para los exportes de residentes. Un trabajo con la
+# misma clave que otro pendiente se comparte; el resultado va a la caché de
+# exportes de db.py y el progreso (filas escritas) a un dict compartido.
+EXPORT_WORKERS = 2
+TUTOR_SLOTS    = 1
+JOBS_MAX       = 64     # trabajos terminados que se recuerdan
+ACTIVE         = ("wartet", "läuft")
+
+class ExportSpec(NamedTuple):
+    fmt:      str           # clave de export.EXPORT_FORMATS o "PDF"
+    username: str
+    is_tutor: bool
+    flt:      db.OpsFilter
+    title:    str = ""
+    year:     int = 0
+
+def _init_worker(db_path):
+    from streamlit.logger import set_log_level
+    set_log_level("error")  # modo "bare": sin runtime de Streamlit
+    db.DB_PATH = db_path
+    db.reset_pool()
+
+# Se ejecuta en el proceso del pool: lee con su propia conexión y anota las
+# filas procesadas tras cada bloque de iter_ops.
+def _run(jid, progress, spec):
+    done = 0
+    def tracked(chunks):
+        nonlocal done
+        for rows in chunks:
+            yield rows
+            done += len(rows)
+            progress[jid] = done
+    chunks = tracked(db.iter_ops(spec.username, spec.is_tutor, spec.flt))
+    if spec.fmt == "PDF":
+        from pdf_report import make_pdf_bytes
+        return make_pdf_bytes(spec.username, spec.is_tutor, spec.flt, spec.title,
+                              spec.year, chunks)
+    from export import export_bytes
+    return export_bytes(spec.fmt, db.ops_headers(spec.is_tutor), chunks)
+
+def _new_pool():
+    return ProcessPoolExecutor(EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(db.DB_PATH,))
+
+@st.cache_resource
+def _runner():
+    ctx = multiprocessing.get_context("spawn")
+    return {"lock": threading.RLock(), "ids": itertools.count(1), "pool": _new_pool(),
+            "progress": ctx.Manager().dict(), "jobs": OrderedDict(),
+            "queue": deque(), "tutor_running": 0}
+
+# Si un proceso del pool muere (p. ej. sin memoria en un PDF de tutor), el pool
+# queda roto: sus trabajos en curso fallan y no acepta más. Se sustituye por
+# uno nuevo (una vez por pool roto) para que la cola siga.
+def _replace_pool(r, broken):
+    if r["pool"] is broken:
+        r["pool"] = _new_pool()
+        broken.shutdown(wait=False)
+
+# El estado y la plaza de tutor sólo cambian si el pool acepta el trabajo.
+def _start(r, jid, spec):
+    job, pool = r["jobs"][jid], r["pool"]
+    try:
+        fut = pool.submit(_run, jid, r["progress"], spec)
+    except BrokenProcessPool as e:
+        _replace_pool(r, pool)
+        job.update(state="fehler", error=repr(e), finished=time.time())
+        return
+    job.update(state="läuft", started=time.time())
+    if job["owner"] is None:
+        r["tutor_running"] += 1
+    fut.add_done_callback(lambda f: _finish(r, jid, f, pool))
+
+def _dispatch(r):
+    while r["queue"] and r["tutor_running"] < TUTOR_SLOTS:
+        _start(r, *r["queue"].popleft())
+
+def _finish(r, jid, fut, pool):
+    err = fut.exception()
+    with r["lock"]:
+        if isinstance(err, BrokenProcessPool):
+            _replace_pool(r, pool)
+        job = r["jobs"][jid]
+        if job["owner"] is None:
+            r["tutor_running"] -= 1
+        if err is None:
+            stored = db.store_export(job["key"], fut.result())
+            job.update(state="fertig" if stored else "veraltet")
+        else:
+            job.update(state="fehler", error=repr(err))
+        job["finished"] = time.time()
+        r["progress"].pop(jid, None)
+        _dispatch(r)
+    profiling.record("export", f"job_{job['kind']}", job["finished"] - job["started"],
+                     job["total"])
+
+# Devuelve el id del trabajo (nuevo o el pendiente con la misma clave).
+def submit(owner, kind, sig, total, spec):
+    key = db.export_key(owner, kind, sig)
+    r   = _runner()
+    with r["lock"]:
+        for jid, job in r["jobs"].items():
+            if job["key"] == key and job["state"] in ACTIVE:
+                return jid
+        jid = f"job{next(r['ids'])}"
+        r["jobs"][jid] = dict(key=key, owner=owner, kind=kind, total=total, state="wartet",
+                              error=None, submitted=time.time(), started=None, finished=None)
+        if owner is None:
+            r["queue"].append((jid, spec))
+            _dispatch(r)
+        else:
+            _start(r, jid, spec)
+        done = [j for j, job in r["jobs"].items() if job["state"] not in ACTIVE]
+        for j in done[:max(len(done) - JOBS_MAX, 0)]:
+            del r["jobs"][j]
+    return jid
+
+# Último trabajo con la clave actual de (owner, kind, sig), con su progreso.
+def latest(owner, kind, sig):
+    key = db.export_key(owner, kind, sig)
+    r   = _runner()
+    with r["lock"]:
+        jid = next((j for j in reversed(r["jobs"]) if r["jobs"][j]["key"] == key), None)
+        if jid is None:
+            return None
+        job = dict(r["jobs"][jid], id=jid)
+        job["done"] = r["progress"].get(jid, 0) if job["state"] == "läuft" else 0
+        if job["state"] == "wartet":
+            job["position"] = 1 + [j for j, _ in r["queue"]].index(jid)
+    return job
@@ -0,0 +1,26 @@
+# ─── CATÁLOGO ─────────────────────────────────────────────────────────────────
+# Categorías, intervenciones y valores de selección del Logbuch. Módulo sin
+# Streamlit para que la app, el import, el PDF y los scripts compartan la lista.
+ANNUAL_GOALS = {"Operation": 50, "Intervention": 30, "Prozedur": 20}
+KATEGORIEN   = ["Operation", "Intervention", "Prozedur"]
+ROLLEN           = ["Operateur", "Assistent"]
+ZUGAENGE         = ["Punktion", "Offen"]
+VERSCHLUSSSYSTEM = ["AngioSeal", "ProGlide"]
+
+EINGRIFFE = {
+    "Operation": [
+        "Carotis EEA/TEA", "Aortenaneurysma Rohrprothese", "Aortenaneurysma Bypass",
+        "Aortobi- oder monoiliakaler Bypass", "Aortobi- oder monofemoraler Bypass",
+        "Iliofemoraler Bypass", "Crossover Bypass", "Femoralis TEA",
+        "Fem-pop. P1 Bypass", "Fem-pop. P3 Bypass", "Fem-cruraler Bypass",
+        "P1-P3 Bypass", "Wunddebridement - VAC Wechsel",
+    ],
+    "Intervention": [
+        "TEVAR", "FEVAR", "EVAR", "BEVAR", "Organstent",
+        "Beckenstent", "Beinstent", "Thrombektomie over the wire",
+    ],
+    "Prozedur": [
+        "ZVK-Anlage", "Drainage Thorax", "Drainage Abdomen",
+        "Drainage Wunde Extremitäten", "Punktion/PE",
+    ],
+}
@@ -1,17 +1,31 @@
 import streamlit as st
 import sqlite3
-import csv
 import hashlib
-import io
 import calendar
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from collections import defaultdict
 
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas as rl_canvas
+
+from cohort import fetch_cohort
+from db import (
+    OpsFilter, get_cur, writer, insert_op, bulk_insert_ops, delete_ops, peek_export,
+    fetch_ops_page, count_ops, archived_years,
+    fetch_dashboard, fetch_ranking, fetch_top_eingriffe, search_ops, SEARCH_RANK_MAX,
+)
+from export import EXPORT_FORMATS
+from importer import read_import_file, validate_import
+from katalog import (ANNUAL_GOALS, KATEGORIEN, EINGRIFFE, ROLLEN, ZUGAENGE,
+                     VERSCHLUSSSYSTEM)
+import jobs
+import profiling
+from profiling import profiled, stage
+from table_style import ops_column_config
+
+RUN_T0 = time.perf_counter()
 
 # ─── CONFIGURACIÓN DE PÁGINA ──────────────────────────────────────────────────
 st.set_page_config(
@@ -126,64 +140,7 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # ─── CONFIGURACIÓN ────────────────────────────────────────────────────────────
-ANNUAL_GOALS = {"Operation": 50, "Intervention": 30, "Prozedur": 20}
-KATEGORIEN   = ["Operation", "Intervention", "Prozedur"]
-
-EINGRIFFE = {
-    "Operation": [
-        "Carotis EEA/TEA", "Aortenaneurysma Rohrprothese", "Aortenaneurysma Bypass",
-        "Aortobi- oder monoiliakaler Bypass", "Aortobi- oder monofemoraler Bypass",
-        "Iliofemoraler Bypass", "Crossover Bypass", "Femoralis TEA",
-        "Fem-pop. P1 Bypass", "Fem-pop. P3 Bypass", "Fem-cruraler Bypass",
-        "P1-P3 Bypass", "Wunddebridement - VAC Wechsel",
-    ],
-    "Intervention": [
-        "TEVAR", "FEVAR", "EVAR", "BEVAR", "Organstent",
-        "Beckenstent", "Beinstent", "Thrombektomie over the wire",
-    ],
-    "Prozedur": [
-        "ZVK-Anlage", "Drainage Thorax", "Drainage Abdomen",
-        "Drainage Wunde Extremitäten", "Punktion/PE",
-    ],
-}
-
-# ─── BASE DE DATOS ────────────────────────────────────────────────────────────
-@st.cache_resource
-def get_conn():
-    conn = sqlite3.connect("chirurgischer_bericht.db", check_same_thread=False)
-    cur  = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS users
-        (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT,
-         security_question TEXT, security_answer TEXT)""")
-    cur.execute("PRAGMA table_info(users)")
-    user_cols = [r[1] for r in cur.fetchall()]
-    for col, sql in [
-        ("security_question", "ALTER TABLE users ADD COLUMN security_question TEXT"),
-        ("security_answer",   "ALTER TABLE users ADD COLUMN security_answer TEXT"),
-    ]:
-        if col not in user_cols:
-            cur.execute(sql)
-    cur.execute("""CREATE TABLE IF NOT EXISTS operationen (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        datum TEXT, datum_sort TEXT, eingriff TEXT, rolle TEXT,
-        patient_id TEXT, diagnose TEXT, kategorie TEXT,
-        zugang TEXT, verschlusssystem TEXT, notizen TEXT,
-        username TEXT, user_id INTEGER)""")
-    cur.execute("PRAGMA table_info(operationen)")
-    cols = [r[1] for r in cur.fetchall()]
-    for col, sql in [
-        ("zugang",           "ALTER TABLE operationen ADD COLUMN zugang TEXT"),
-        ("verschlusssystem", "ALTER TABLE operationen ADD COLUMN verschlusssystem TEXT"),
-        ("username",         "ALTER TABLE operationen ADD COLUMN username TEXT"),
-        ("datum_sort",       "ALTER TABLE operationen ADD COLUMN datum_sort TEXT"),
-        ("user_id",          "ALTER TABLE operationen ADD COLUMN user_id INTEGER"),
-    ]:
-        if col not in cols:
-            cur.execute(sql)
-    conn.commit()
-    return conn
-
-def get_cur(): return get_conn().cursor()
+SEARCH_PAGE = 25
 
 # ─── UTILIDADES ───────────────────────────────────────────────────────────────
 def hash_pw(pw):   return hashlib.sha256(pw.encode()).hexdigest()
@@ -192,77 +149,6 @@ def date_ok(d):
     except: return False
 def to_sort(d):    return datetime.strptime(d, "%d.%m.%Y").strftime("%Y-%m-%d")
 
-def reorder_ids(uname):
-    conn = get_conn(); cur = conn.cursor()
-    cur.execute("SELECT id FROM operationen WHERE username=? ORDER BY id", (uname,))
-    for new_id, (old_id,) in enumerate(cur.fetchall(), 1):
-        cur.execute("UPDATE operationen SET user_id=? WHERE id=? AND username=?",
-                    (new_id, old_id, uname))
-    conn.commit()
-
-# ─── QUERIES ──────────────────────────────────────────────────────────────────
-def fetch_ops(username, is_tutor, extra="", params=()):
-    cur = get_cur()
-    if is_tutor:
-        sql = "SELECT datum,eingriff,rolle,patient_id,kategorie,username FROM operationen"
-        if extra: sql += f" WHERE {extra}"
-        cur.execute(sql, params)
-        cols = ["Datum","Eingriff","Rolle","Patient","Kategorie","Benutzer"]
-    else:
-        base = "WHERE username=?" + (f" AND ({extra})" if extra else "")
-        cur.execute(
-            f"SELECT user_id,datum,eingriff,rolle,patient_id,diagnose,kategorie,"
-            f"zugang,verschlusssystem,notizen FROM operationen {base} ORDER BY user_id",
-            (username,) + params)
-        cols = ["ID","Datum","Eingriff","Rolle","Patient","Diagnose",
-                "Kategorie","Zugang","Verschlusssystem","Notizen"]
-    rows = cur.fetchall()
-    return pd.DataFrame(rows, columns=cols) if rows else pd.DataFrame(columns=cols)
-
-def fetch_monthly(username, year):
-    cur = get_cur()
-    w   = f"strftime('%Y',datum_sort)='{year}'"
-    p   = ()
-    if username:
-        w += " AND username=?"; p = (username,)
-    cur.execute(
-        f"SELECT strftime('%m',datum_sort) as m, kategorie, COUNT(*) "
-        f"FROM operationen WHERE {w} GROUP BY m, kategorie", p)
-    data = defaultdict(lambda: defaultdict(int))
-    for m, k, n in cur.fetchall():
-        data[int(m)][k] = n
-    return data
-
-def fetch_totals(username):
-    cur = get_cur()
-    w, p = ("WHERE username=?", (username,)) if username else ("", ())
-    cur.execute(f"SELECT kategorie, COUNT(*) FROM operationen {w} GROUP BY kategorie", p)
-    return dict(cur.fetchall())
-
-def fetch_roles(username):
-    cur = get_cur()
-    w, p = ("WHERE username=?", (username,)) if username else ("", ())
-    cur.execute(f"SELECT rolle, COUNT(*) FROM operationen {w} GROUP BY rolle", p)
-    return dict(cur.fetchall())
-
-def fetch_ranking():
-    cur = get_cur()
-    cur.execute("""
-        SELECT username, COUNT(*) as total,
-            SUM(CASE WHEN kategorie='Operation'    THEN 1 ELSE 0 END),
-            SUM(CASE WHEN kategorie='Intervention' THEN 1 ELSE 0 END),
-            SUM(CASE WHEN kategorie='Prozedur'     THEN 1 ELSE 0 END)
-        FROM operationen GROUP BY username ORDER BY total DESC""")
-    return cur.fetchall()
-
-def fetch_top_eingriffe(username):
-    cur = get_cur()
-    cur.execute(
-        "SELECT eingriff, rolle, COUNT(*) n FROM operationen "
-        "WHERE username=? GROUP BY eingriff, rolle ORDER BY n DESC LIMIT 10",
-        (username,))
-    return cur.fetchall()
-
 # ─── PLOTLY HELPERS ───────────────────────────────────────────────────────────
 PLOTLY_LAYOUT = dict(
     paper_bgcolor=C["panel"], plot_bgcolor=C["bg"],
@@ -279,6 +165,38 @@ def _legend_style(**kwargs):
     base.update(kwargs)
     return base
 
+# Figuras ya construidas, compartidas entre sesiones. La clave es una huella de
+# los agregados que las alimentan (más el año), así un rerun sin cambios en los
+# datos reutiliza la figura; se descartan las menos usadas por encima del límite.
+FIGURE_MAX = 64
+
+@st.cache_resource
+def _figure_store():
+    return {"lock": threading.Lock(), "figs": OrderedDict()}
+
+def cached_figure(name, data, build):
+    key = (name, hashlib.sha1(repr(data).encode()).hexdigest())
+    s = _figure_store()
+    with stage("plotly", f"fig_{name}") as rec:
+        with s["lock"]:
+            fig = s["figs"].get(key)
+            if fig is not None:
+                s["figs"].move_to_end(key)
+                rec["cache"] = "hit"
+                return fig
+        rec["cache"] = "miss"
+        fig = build()
+        with s["lock"]:
+            s["figs"][key] = fig
+            while len(s["figs"]) > FIGURE_MAX:
+                s["figs"].popitem(last=False)
+        return fig
+
+# st.plotly_chart serializa la figura a JSON en cada rerun.
+def show_figure(fig, name):
+    with stage("plotly", f"render_{name}"):
+        st.plotly_chart(fig, use_container_width=True)
+
 def progress_bar_html(label, current, goal, color):
     pct      = min(current / goal, 1.0) if goal else 0
     pct_int  = int(pct * 100)
@@ -297,26 +215,102 @@ def progress_bar_html(label, current, goal, color):
       </div>
     </div>"""
 
-# ─── PDF EXPORT ───────────────────────────────────────────────────────────────
-def make_pdf_bytes(df: pd.DataFrame, title: str) -> bytes:
-    buf = io.BytesIO()
-    c   = rl_canvas.Canvas(buf, pagesize=letter)
-    c.setFont("Helvetica-Bold", 14); c.drawString(60, 760, title)
-    c.setFont("Helvetica", 8); y = 730
-    for _, row in df.iterrows():
-        text = " | ".join(str(v) for v in row if v)
-        while len(text) > 120:
-            c.drawString(40, y, text[:120]); text = "  " + text[120:]; y -= 13
-            if y < 50: c.showPage(); c.setFont("Helvetica", 8); y = 750
-        c.drawString(40, y, text); y -= 18
-        if y < 50: c.showPage(); c.setFont("Helvetica", 8); y = 750
-    c.save(); buf.seek(0)
-    return buf.read()
+# ─── FIGURAS DEL DASHBOARD ────────────────────────────────────────────────────
+def build_fig_line(dash, year):
+    m_lbls = [calendar.month_abbr[m] for m in range(1, 13)]
+    fig_line = go.Figure()
+    kat_colors = [C["op"], C["interv"], C["proz"]]
+
+    for kat, col_k in zip(KATEGORIEN, kat_colors):
+        vals = dash.month(kat)
+        r, g, b = int(col_k[1:3],16), int(col_k[3:5],16), int(col_k[5:7],16)
+        fig_line.add_trace(go.Scatter(
+            x=m_lbls, y=vals, name=kat,
+            mode="lines+markers",
+            line=dict(color=col_k, width=2.5),
+            marker=dict(size=6, color=col_k, line=dict(color=C["bg"], width=1.5)),
+            fill="tozeroy",
+            fillcolor=f"rgba({r},{g},{b},0.08)",
+        ))
+
+    fig_line.add_trace(go.Scatter(
+        x=m_lbls, y=dash.cumulative, name="Kumuliert",
+        mode="lines", yaxis="y2",
+        line=dict(color=C["yellow"], width=2, dash="dot"),
+    ))
+    fig_line.update_layout(
+        **PLOTLY_LAYOUT,
+        title=dict(text=f"Monatsverlauf {year}", font_color=C["text"], font_size=13),
+        height=300,
+        xaxis=_axis_style(),
+        yaxis=_axis_style(),
+        yaxis2=dict(overlaying="y", side="right", **_axis_style(),
+                    title=dict(text="Kumuliert", font_color=C["muted"])),
+        legend=_legend_style(orientation="h", y=-0.25),
+    )
+    return fig_line
+
+def build_fig_rank(df_rank):
+    kat_colors = [C["op"], C["interv"], C["proz"]]
+    fig_rank = go.Figure()
+    for kat, col_k in zip(KATEGORIEN, kat_colors):
+        fig_rank.add_trace(go.Bar(
+            y=df_rank["Benutzer"], x=df_rank[kat],
+            name=kat, orientation="h",
+            marker_color=col_k, opacity=0.88,
+        ))
+    fig_rank.update_layout(
+        **PLOTLY_LAYOUT,
+        barmode="stack", height=250,
+        title=dict(text="Eingriffe gesamt nach Benutzer",
+                   font_color=C["text"], font_size=12),
+        xaxis=_axis_style(),
+        yaxis=_axis_style(),
+        legend=_legend_style(orientation="h", y=-0.3),
+    )
+    return fig_rank
+
+def build_fig_top(df_top):
+    # go.Bar por rol en lugar de px.bar: plotly.express añade ~0.15s al arranque.
+    fig_top = go.Figure()
+    for rolle, col_r in (("Operateur", C["accent"]), ("Assistent", C["accent2"])):
+        d = df_top[df_top["Rolle"] == rolle]
+        fig_top.add_trace(go.Bar(x=d["n"], y=d["Eingriff"], name=rolle,
+                                 orientation="h", marker_color=col_r))
+    fig_top.update_layout(**PLOTLY_LAYOUT, height=280, barmode="relative",
+                          showlegend=True,
+                          xaxis=dict(**_axis_style(), title_text="n"),
+                          yaxis=dict(**_axis_style(), title_text="Eingriff"),
+                          legend=_legend_style(orientation="h", y=-0.3,
+                                               title_text="Rolle"))
+    return fig_top
+
+def build_fig_trend(trend, year):
+    m_lbls = [calendar.month_abbr[m] for m in range(1, 13)]
+    fig_trend = go.Figure()
+    fig_trend.add_trace(go.Scatter(x=m_lbls, y=trend["P75"], name="P75", mode="lines",
+                                   line=dict(color=C["accent3"], width=0)))
+    fig_trend.add_trace(go.Scatter(x=m_lbls, y=trend["P25"], name="P25–P75", mode="lines",
+                                   line=dict(color=C["accent3"], width=0),
+                                   fill="tonexty", fillcolor="rgba(74,143,240,0.18)"))
+    fig_trend.add_trace(go.Scatter(x=m_lbls, y=trend["P50"], name="Median",
+                                   mode="lines+markers",
+                                   line=dict(color=C["accent"], width=2.5)))
+    fig_trend.update_layout(
+        **PLOTLY_LAYOUT,
+        title=dict(text=f"Anteil Operateur (12 Monate gleitend) · {year}",
+                   font_color=C["text"], font_size=12),
+        height=260,
+        xaxis=_axis_style(),
+        yaxis=dict(**_axis_style(), ticksuffix="%"),
+        legend=_legend_style(orientation="h", y=-0.3),
+    )
+    return fig_trend
 
 # ─── SESSION STATE ────────────────────────────────────────────────────────────
 for key, default in [
     ("logged_in", False), ("username", ""), ("is_tutor", False),
-    ("sel_year", datetime.now().year),
+    ("sel_year", datetime.now().year), ("import_n", 0),
 ]:
     if key not in st.session_state:
         st.session_state[key] = default
@@ -368,12 +362,11 @@ if not st.session_state.logged_in:
                         st.error("Alle Felder erforderlich.")
                     else:
                         try:
-                            conn = get_conn()
-                            conn.execute(
-                                "INSERT INTO users (username,password,security_question,security_answer) "
-                                "VALUES (?,?,?,?)",
-                                (u, hash_pw(p), sq, hash_pw(sa.strip().lower())))
-                            conn.commit()
+                            with writer() as conn:
+                                conn.execute(
+                                    "INSERT INTO users (username,password,security_question,security_answer) "
+                                    "VALUES (?,?,?,?)",
+                                    (u, hash_pw(p), sq, hash_pw(sa.strip().lower())))
                             st.success("Benutzer registriert. Bitte anmelden.")
                         except sqlite3.IntegrityError:
                             st.error("Benutzername existiert bereits.")
@@ -422,11 +415,10 @@ if not st.session_state.logged_in:
                                     "SELECT id FROM users WHERE username=? AND security_answer=?",
                                     (reset_u, hash_pw(rst_ans.strip().lower())))
                                 if cur2.fetchone():
-                                    conn = get_conn()
-                                    conn.execute(
-                                        "UPDATE users SET password=? WHERE username=?",
-                                        (hash_pw(rst_p1), reset_u))
-                                    conn.commit()
+                                    with writer() as conn:
+                                        conn.execute(
+                                            "UPDATE users SET password=? WHERE username=?",
+                                            (hash_pw(rst_p1), reset_u))
                                     st.success("✓ Passwort erfolgreich geändert. Bitte anmelden.")
                                 else:
                                     st.error("Antwort falsch. Bitte erneut versuchen.")
@@ -440,9 +432,30 @@ if not st.session_state.logged_in:
 # ══════════════════════════════════════════════════════════════════════════════
 # APP PRINCIPAL — layout único
 # ══════════════════════════════════════════════════════════════════════════════
+# Cada sección es un fragmento con nombre que recibe como argumentos lo que usa;
+# una interacción sólo vuelve a ejecutar las secciones que dependen de ella:
+#   año ◀ ▶                     → dashboard y export
+#   filtros, búsqueda, páginas  → logbuch (export va anidado dentro)
+#   crear un exporte            → export
+#   formulario, import          → neue_op
+# Un alta, un import o un borrado cambian todo: rerun de la app completa.
 username  = st.session_state.username
 is_tutor  = st.session_state.is_tutor
-year      = st.session_state.sel_year
+
+def shift_year(d):
+    st.session_state.sel_year += d
+    st.rerun(["dashboard", "export"])
+
+# Avisos que sobreviven al rerun de toda la app tras una escritura.
+def flash(key, msg):
+    st.session_state[key] = msg
+
+def show_flash(key, balloons=False):
+    msg = st.session_state.pop(key, None)
+    if msg:
+        st.success(msg)
+        if balloons:
+            st.balloons()
 
 # ── SIDEBAR ───────────────────────────────────────────────────────────────────
 with st.sidebar:
@@ -455,181 +468,157 @@ with st.sidebar:
     </div>""", unsafe_allow_html=True)
     st.divider()
 
-    # Selector de año
-    st.markdown(f"<p style='color:{C['muted']};font-size:11px;font-weight:700;"
-                f"text-transform:uppercase;letter-spacing:1px'>Anzeige-Jahr</p>",
-                unsafe_allow_html=True)
-    c1, c2, c3 = st.columns([1, 2, 1])
-    with c1:
-        if st.button("◀", key="yr_back"):
-            st.session_state.sel_year -= 1; st.rerun()
-    with c2:
-        st.markdown(f"<div style='text-align:center;color:{C['accent']};"
-                    f"font-weight:800;font-size:18px;padding-top:4px'>{year}</div>",
-                    unsafe_allow_html=True)
-    with c3:
-        if st.button("▶", key="yr_fwd"):
-            st.session_state.sel_year += 1; st.rerun()
-
-    st.divider()
-    if st.button("🚪 Abmelden", use_container_width=True):
-        for k in ["logged_in", "username", "is_tutor"]:
-            st.session_state[k] = False if k != "username" else ""
-        st.rerun()
-
 # ══════════════════════════════════════════════════════════════════════════════
 # SECCIÓN 1: DASHBOARD (siempre visible)
 # ══════════════════════════════════════════════════════════════════════════════
-uname_dash = None if is_tutor else username
-totals  = fetch_totals(uname_dash)
-roles   = fetch_roles(uname_dash)
-monthly = fetch_monthly(uname_dash, year)
-
-st.markdown(f"<h2 style='color:{C['text']};margin:0 0 16px'>📊 Dashboard "
-            f"{'— Alle Residenten' if is_tutor else '— ' + username} · {year}</h2>",
-            unsafe_allow_html=True)
+@st.fragment(key="dashboard")
+@profiled("fragment", "dashboard", cached=False)
+def dashboard_section(username, is_tutor):
+    year = st.session_state.sel_year
+    # Selector de año (en la barra lateral, pero parte de este fragmento)
+    with st.sidebar:
+        st.markdown(f"<p style='color:{C['muted']};font-size:11px;font-weight:700;"
+                    f"text-transform:uppercase;letter-spacing:1px'>Anzeige-Jahr</p>",
+                    unsafe_allow_html=True)
+        c1, c2, c3 = st.columns([1, 2, 1])
+        with c1:
+            st.button("◀", key="yr_back", on_click=shift_year, args=(-1,))
+        with c2:
+            st.markdown(f"<div style='text-align:center;color:{C['accent']};"
+                        f"font-weight:800;font-size:18px;padding-top:4px'>{year}</div>",
+                        unsafe_allow_html=True)
+        with c3:
+            st.button("▶", key="yr_fwd", on_click=shift_year, args=(1,))
 
-# ── KPI Cards ──
-k1, k2, k3, k4, k5, k6 = st.columns(6)
-total_n = sum(totals.values())
-kpi_data = [
-    (k1, total_n,                       "Gesamt"),
-    (k2, roles.get("Operateur", 0),     "Operateur"),
-    (k3, roles.get("Assistent", 0),     "Assistent"),
-    (k4, totals.get("Operation", 0),    "Operationen"),
-    (k5, totals.get("Intervention", 0), "Interventionen"),
-    (k6, totals.get("Prozedur", 0),     "Prozeduren"),
-]
-for col, val, label in kpi_data:
-    with col:
-        st.metric(label, val)
-
-st.divider()
-
-# ── Fila: gráfico mensual + metas ──
-col_chart, col_right = st.columns([2.2, 1])
-
-with col_chart:
-    m_lbls = [calendar.month_abbr[m] for m in range(1, 13)]
-    fig_line = go.Figure()
-    kat_colors = [C["op"], C["interv"], C["proz"]]
+    dash = fetch_dashboard(None if is_tutor else username, year)
 
-    for kat, col_k in zip(KATEGORIEN, kat_colors):
-        vals = [monthly[m].get(kat, 0) for m in range(1, 13)]
-        r, g, b = int(col_k[1:3],16), int(col_k[3:5],16), int(col_k[5:7],16)
-        fig_line.add_trace(go.Scatter(
-            x=m_lbls, y=vals, name=kat,
-            mode="lines+markers",
-            line=dict(color=col_k, width=2.5),
-            marker=dict(size=6, color=col_k, line=dict(color=C["bg"], width=1.5)),
-            fill="tozeroy",
-            fillcolor=f"rgba({r},{g},{b},0.08)",
-        ))
+    st.markdown(f"<h2 style='color:{C['text']};margin:0 0 16px'>📊 Dashboard "
+                f"{'— Alle Residenten' if is_tutor else '— ' + username} · {year}</h2>",
+                unsafe_allow_html=True)
 
-    cumul = []; acc = 0
-    for m in range(1, 13):
-        acc += sum(monthly[m].values()); cumul.append(acc)
-    fig_line.add_trace(go.Scatter(
-        x=m_lbls, y=cumul, name="Kumuliert",
-        mode="lines", yaxis="y2",
-        line=dict(color=C["yellow"], width=2, dash="dot"),
-    ))
-    fig_line.update_layout(
-        **PLOTLY_LAYOUT,
-        title=dict(text=f"Monatsverlauf {year}", font_color=C["text"], font_size=13),
-        height=300,
-        xaxis=_axis_style(),
-        yaxis=_axis_style(),
-        yaxis2=dict(overlaying="y", side="right", **_axis_style(),
-                    title=dict(text="Kumuliert", font_color=C["muted"])),
-        legend=_legend_style(orientation="h", y=-0.25),
-    )
-    st.plotly_chart(fig_line, use_container_width=True)
+    # ── KPI Cards ──
+    k1, k2, k3, k4, k5, k6 = st.columns(6)
+    kpi_data = [
+        (k1, dash.total,                         "Gesamt"),
+        (k2, dash.roles.get("Operateur", 0),     "Operateur"),
+        (k3, dash.roles.get("Assistent", 0),     "Assistent"),
+        (k4, dash.totals.get("Operation", 0),    "Operationen"),
+        (k5, dash.totals.get("Intervention", 0), "Interventionen"),
+        (k6, dash.totals.get("Prozedur", 0),     "Prozeduren"),
+    ]
+    for col, val, label in kpi_data:
+        with col:
+            st.metric(label, val)
 
-with col_right:
-    st.markdown(f"<p class='section-title'>Jahresziele {year}</p>",
-                unsafe_allow_html=True)
-    for kat, col_k in zip(KATEGORIEN, kat_colors):
-        html = progress_bar_html(kat, totals.get(kat, 0), ANNUAL_GOALS[kat], col_k)
-        st.markdown(html, unsafe_allow_html=True)
+    st.divider()
 
-    st.markdown(f"<p class='section-title' style='margin-top:16px'>Rolle</p>",
-                unsafe_allow_html=True)
-    total_r = sum(roles.values()) or 1
-    st.markdown(
-        progress_bar_html("Operateur", roles.get("Operateur", 0), total_r, C["accent"]) +
-        progress_bar_html("Assistent", roles.get("Assistent", 0), total_r, C["accent2"]),
-        unsafe_allow_html=True)
+    # ── Fila: gráfico mensual + metas ──
+    col_chart, col_right = st.columns([2.2, 1])
 
-# ── Fila: ranking (tutor) o top eingriffe (residente) ──
-st.divider()
+    with col_chart:
+        fig_line = cached_figure("line",
+                                 (year, [dash.month(k) for k in KATEGORIEN], dash.cumulative),
+                                 lambda: build_fig_line(dash, year))
+        show_figure(fig_line, "line")
 
-if is_tutor:
-    st.markdown(f"<h4 style='color:{C['text']}'>🏆 Ranking Residenten</h4>",
-                unsafe_allow_html=True)
-    ranking = fetch_ranking()
-    if ranking:
-        df_rank = pd.DataFrame(ranking,
-            columns=["Benutzer","Total","Operation","Intervention","Prozedur"])
-        fig_rank = go.Figure()
+    with col_right:
+        kat_colors = [C["op"], C["interv"], C["proz"]]
+        st.markdown(f"<p class='section-title'>Jahresziele {year}</p>",
+                    unsafe_allow_html=True)
         for kat, col_k in zip(KATEGORIEN, kat_colors):
-            fig_rank.add_trace(go.Bar(
-                y=df_rank["Benutzer"], x=df_rank[kat],
-                name=kat, orientation="h",
-                marker_color=col_k, opacity=0.88,
-            ))
-        fig_rank.update_layout(
-            **PLOTLY_LAYOUT,
-            barmode="stack", height=250,
-            title=dict(text="Eingriffe gesamt nach Benutzer",
-                       font_color=C["text"], font_size=12),
-            xaxis=_axis_style(),
-            yaxis=_axis_style(),
-            legend=_legend_style(orientation="h", y=-0.3),
-        )
-        col_r1, col_r2 = st.columns([1.5, 1])
-        with col_r1:
-            st.plotly_chart(fig_rank, use_container_width=True)
-        with col_r2:
-            st.dataframe(
-                df_rank.style
-                    .highlight_max(subset=["Total"], color=C["yellow"] + "44")
-                    .format({"Total": "{}", "Operation": "{}",
-                             "Intervention": "{}", "Prozedur": "{}"}),
-                use_container_width=True, hide_index=True)
-    else:
-        st.info("Noch keine Daten vorhanden.")
-else:
-    st.markdown(f"<h4 style='color:{C['text']}'>📌 Top Eingriffe</h4>",
-                unsafe_allow_html=True)
-    rows = fetch_top_eingriffe(username)
-    if rows:
-        df_top = pd.DataFrame(rows, columns=["Eingriff", "Rolle", "n"])
-        col_t1, col_t2 = st.columns([1.5, 1])
-        with col_t1:
-            fig_top = px.bar(
-                df_top, x="n", y="Eingriff", color="Rolle",
-                orientation="h",
-                color_discrete_map={"Operateur": C["accent"], "Assistent": C["accent2"]},
-            )
-            fig_top.update_layout(**PLOTLY_LAYOUT, height=280,
-                                  showlegend=True,
-                                  xaxis=_axis_style(),
-                                  yaxis=_axis_style(),
-                                  legend=_legend_style(orientation="h", y=-0.3))
-            st.plotly_chart(fig_top, use_container_width=True)
-        with col_t2:
-            st.dataframe(df_top, use_container_width=True, hide_index=True)
+            html = progress_bar_html(kat, dash.totals.get(kat, 0), ANNUAL_GOALS[kat], col_k)
+            st.markdown(html, unsafe_allow_html=True)
+
+        st.markdown(f"<p class='section-title' style='margin-top:16px'>Rolle</p>",
+                    unsafe_allow_html=True)
+        total_r = sum(dash.roles.values()) or 1
+        st.markdown(
+            progress_bar_html("Operateur", dash.roles.get("Operateur", 0), total_r, C["accent"]) +
+            progress_bar_html("Assistent", dash.roles.get("Assistent", 0), total_r, C["accent2"]),
+            unsafe_allow_html=True)
+
+    # ── Fila: ranking (tutor) o top eingriffe (residente) ──
+    st.divider()
+
+    if is_tutor:
+        st.markdown(f"<h4 style='color:{C['text']}'>🏆 Ranking Residenten</h4>",
+                    unsafe_allow_html=True)
+        ranking = fetch_ranking()
+        if ranking:
+            with stage("dataframe", "ranking") as rec:
+                df_rank = pd.DataFrame(ranking,
+                    columns=["Benutzer","Total","Operation","Intervention","Prozedur"])
+                rec["rows"] = len(df_rank)
+            fig_rank = cached_figure("rank", ranking, lambda: build_fig_rank(df_rank))
+            col_r1, col_r2 = st.columns([1.5, 1])
+            with col_r1:
+                show_figure(fig_rank, "rank")
+            with col_r2, stage("styler", "ranking") as rec:
+                rec["rows"] = len(df_rank)
+                st.dataframe(
+                    df_rank.style
+                        .highlight_max(subset=["Total"], color=C["yellow"] + "44")
+                        .format({"Total": "{}", "Operation": "{}",
+                                 "Intervention": "{}", "Prozedur": "{}"}),
+                    use_container_width=True, hide_index=True)
+        else:
+            st.info("Noch keine Daten vorhanden.")
+
+        # ── Kohorte: Jahresziele, Raten und Perzentile je Resident ──
+        cohort = fetch_cohort(year, ANNUAL_GOALS)
+        if len(cohort.residents):
+            st.markdown(f"<h4 style='color:{C['text']}'>📈 Kohorte {year}</h4>",
+                        unsafe_allow_html=True)
+            pct_col = lambda label: st.column_config.NumberColumn(label, format="%.0f%%")
+            rate_col = lambda label: st.column_config.NumberColumn(label, format="%.1f")
+            st.dataframe(cohort.residents, use_container_width=True, hide_index=True,
+                         height=min(38 + 35 * len(cohort.residents), 420),
+                         column_config={
+                             "Ziel %": st.column_config.ProgressColumn(
+                                 "Jahresziele", min_value=0, max_value=100, format="%.0f%%"),
+                             "Operateur %":      pct_col("Operateur %"),
+                             "Operateur % Δ12M": st.column_config.NumberColumn(
+                                 "Δ Operateur % (12M)", format="%+.1f"),
+                             "Perzentil 12M":    pct_col("Perzentil (12M)"),
+                             **{c: rate_col(c) for c in cohort.residents.columns
+                                if c.endswith("/ Monat")},
+                         })
+            col_c1, col_c2 = st.columns([1.5, 1])
+            with col_c1:
+                fig_trend = cached_figure("trend", (year, cohort.ratio_trend.round(3).values.tolist()),
+                                          lambda: build_fig_trend(cohort.ratio_trend, year))
+                show_figure(fig_trend, "trend")
+            with col_c2:
+                st.markdown("<p class='section-title'>Perzentile der Kohorte</p>",
+                            unsafe_allow_html=True)
+                st.dataframe(cohort.percentiles.T.round(1), use_container_width=True)
     else:
-        st.info("Noch keine Eingriffe vorhanden.")
+        st.markdown(f"<h4 style='color:{C['text']}'>📌 Top Eingriffe</h4>",
+                    unsafe_allow_html=True)
+        rows = fetch_top_eingriffe(username)
+        if rows:
+            with stage("dataframe", "top_eingriffe") as rec:
+                df_top = pd.DataFrame(rows, columns=["Eingriff", "Rolle", "n"])
+                rec["rows"] = len(df_top)
+            col_t1, col_t2 = st.columns([1.5, 1])
+            with col_t1:
+                fig_top = cached_figure("top", rows, lambda: build_fig_top(df_top))
+                show_figure(fig_top, "top")
+            with col_t2:
+                st.dataframe(df_top, use_container_width=True, hide_index=True)
+        else:
+            st.info("Noch keine Eingriffe vorhanden.")
 
 # ══════════════════════════════════════════════════════════════════════════════
 # SECCIÓN 2: NUEVA OPERACIÓN (solo residentes)
 # ══════════════════════════════════════════════════════════════════════════════
-if not is_tutor:
+@st.fragment(key="neue_op")
+@profiled("fragment", "neue_op", cached=False)
+def neue_op_section(username):
     st.divider()
     st.markdown(f"<h3 style='color:{C['text']};margin:0 0 12px'>➕ Neue Operation eintragen</h3>",
                 unsafe_allow_html=True)
+    show_flash("op_flash", balloons=True)
 
     with st.form("form_neue_op", clear_on_submit=True):
         fc1, fc2, fc3, fc4 = st.columns([1.2, 1.5, 1.5, 1])
@@ -641,7 +630,7 @@ if not is_tutor:
         with fc3:
             eingriff  = st.selectbox("Eingriff *", EINGRIFFE[kategorie])
         with fc4:
-            rolle     = st.selectbox("Rolle *", ["Operateur", "Assistent"])
+            rolle     = st.selectbox("Rolle *", ROLLEN)
 
         fc5, fc6, fc7 = st.columns(3)
         with fc5:
@@ -655,18 +644,16 @@ if not is_tutor:
         if kategorie == "Intervention":
             fi1, fi2 = st.columns(2)
             with fi1:
-                zugang = st.selectbox("Zugang *", ["Punktion", "Offen"])
+                zugang = st.selectbox("Zugang *", ZUGAENGE)
             with fi2:
                 if zugang == "Punktion":
                     verschlusssystem = st.selectbox("Verschlusssystem *",
-                                                    ["AngioSeal", "ProGlide"])
+                                                    VERSCHLUSSSYSTEM)
 
         submitted = st.form_submit_button("＋ Hinzufügen", use_container_width=True,
                                           type="primary")
 
     if submitted:
-        datum_str = datum_dt.strftime("%d.%m.%Y")
-        datum_sort = datum_dt.strftime("%Y-%m-%d")
         errors = []
         if not patient_id: errors.append("Patienten-ID fehlt")
         if not diagnose:   errors.append("Diagnose fehlt")
@@ -675,105 +662,265 @@ if not is_tutor:
         if errors:
             st.error(" · ".join(errors))
         else:
-            conn = get_conn()
-            cur  = conn.cursor()
-            cur.execute("SELECT MAX(user_id) FROM operationen WHERE username=?", (username,))
-            uid = (cur.fetchone()[0] or 0) + 1
-            conn.execute(
-                "INSERT INTO operationen (datum,datum_sort,eingriff,rolle,patient_id,"
-                "diagnose,kategorie,zugang,verschlusssystem,notizen,username,user_id) "
-                "VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
-                (datum_str, datum_sort, eingriff, rolle, patient_id,
-                 diagnose, kategorie, zugang, verschlusssystem, notizen, username, uid))
-            conn.commit()
-            st.success(f"✓ Operation '{eingriff}' erfolgreich registriert (ID {uid}).")
-            st.balloons()
+            uid = insert_op(username, dict(
+                datum=datum_dt.strftime("%Y-%m-%d"), eingriff=eingriff, rolle=rolle,
+                patient_id=patient_id, diagnose=diagnose, kategorie=kategorie,
+                zugang=zugang, verschlusssystem=verschlusssystem, notizen=notizen))
+            flash("op_flash", f"✓ Operation '{eingriff}' erfolgreich registriert (ID {uid}).")
+            st.rerun()
+
+    # ── Import masivo (CSV/Excel con los encabezados del exporte) ──
+    with st.expander("📥 Massenimport (CSV / Excel)", expanded=False):
+        st.markdown(
+            f"<p style='color:{C['muted']};font-size:12px'>Spalten wie im Export: "
+            "Datum (TT.MM.JJJJ), Kategorie, Eingriff, Rolle, Patient, Diagnose, "
+            "Zugang, Verschlusssystem, Notizen.</p>", unsafe_allow_html=True)
+        show_flash("import_flash")
+        # Clave nueva tras cada import: el uploader se vacía y el archivo ya
+        # importado no vuelve a ofrecer el botón.
+        up = st.file_uploader("Datei", type=["csv", "xlsx"], label_visibility="collapsed",
+                              key=f"import_file_{st.session_state.import_n}")
+        if up is not None:
+            try:
+                imp_ok, imp_err = validate_import(read_import_file(up.name, up.getvalue()),
+                                                  EINGRIFFE)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.caption(f"{len(imp_ok)} gültige Zeilen · {len(imp_err)} fehlerhafte Zeilen")
+                if len(imp_err):
+                    st.dataframe(imp_err, use_container_width=True, hide_index=True,
+                                 height=min(38 + 35 * len(imp_err), 300))
+                if len(imp_ok) and st.button(f"＋ {len(imp_ok)} Einträge importieren",
+                                             type="primary"):
+                    n = bulk_insert_ops(username, imp_ok.to_dict("records"))
+                    st.session_state.import_n += 1
+                    flash("import_flash", f"✓ {n} Operationen importiert.")
+                    st.rerun()
 
 # ══════════════════════════════════════════════════════════════════════════════
 # SECCIÓN 3: LOGBUCH (siempre visible)
 # ══════════════════════════════════════════════════════════════════════════════
-st.divider()
-st.markdown(f"<h3 style='color:{C['text']};margin:0 0 12px'>📋 Logbuch</h3>",
-            unsafe_allow_html=True)
+def _sel(v): return None if v == "Alle" else v
 
-# ── Filtros ──
-with st.expander("🔍 Suchen & Filtern", expanded=False):
-    fc1, fc2, fc3 = st.columns(3)
-    with fc1:
-        filter_kat = st.selectbox("Kategorie", ["Alle"] + KATEGORIEN)
-    with fc2:
-        filter_rolle = st.selectbox("Rolle", ["Alle", "Operateur", "Assistent"])
-    with fc3:
-        if is_tutor:
-            cur = get_cur()
-            cur.execute("SELECT username FROM users")
-            all_users = ["Alle"] + [r[0] for r in cur.fetchall()]
-            filter_user = st.selectbox("Benutzer", all_users)
+def shift_fts_page(d):
+    st.session_state.fts_page += d
+
+def log_page_back():
+    st.session_state.log_keys.pop()
+
+def log_page_fwd(key):
+    st.session_state.log_keys.append(key)
+
+@st.fragment(key="logbuch")
+@profiled("fragment", "logbuch", cached=False)
+def logbuch_section(username, is_tutor):
+    st.divider()
+    st.markdown(f"<h3 style='color:{C['text']};margin:0 0 12px'>📋 Logbuch</h3>",
+                unsafe_allow_html=True)
+    show_flash("log_flash")
+
+    # ── Filtros ──
+    with st.expander("🔍 Suchen & Filtern", expanded=False):
+        search = st.text_input("Volltextsuche (Diagnose, Notizen, Eingriff, Patient)",
+                               placeholder="z. B. Aneurysma, P1234 …").strip()
+        fc1, fc2, fc3, fc4 = st.columns(4)
+        with fc1:
+            filter_kat = st.selectbox("Kategorie", ["Alle"] + KATEGORIEN)
+        with fc2:
+            filter_rolle = st.selectbox("Rolle", ["Alle"] + ROLLEN)
+        with fc3:
+            if is_tutor:
+                cur = get_cur()
+                cur.execute("SELECT username FROM users")
+                all_users = ["Alle"] + [r[0] for r in cur.fetchall()]
+                filter_user = st.selectbox("Benutzer", all_users)
+            else:
+                filter_user = username
+        with fc4:
+            filter_range = st.date_input("Zeitraum", value=(), format="DD.MM.YYYY")
+        fe1, fe2, fe3 = st.columns([2, 1, 1])
+        with fe1:
+            eingriffe = (EINGRIFFE[filter_kat] if filter_kat != "Alle"
+                         else sorted({e for es in EINGRIFFE.values() for e in es}))
+            filter_eingriff = st.selectbox("Eingriff", ["Alle"] + eingriffe)
+        with fe2:
+            filter_zugang = st.selectbox("Zugang", ["Alle"] + ZUGAENGE)
+        with fe3:
+            filter_verschluss = st.selectbox("Verschlusssystem", ["Alle"] + VERSCHLUSSSYSTEM)
+
+    flt = OpsFilter(
+        kategorie=_sel(filter_kat), rolle=_sel(filter_rolle),
+        benutzer=_sel(filter_user) if is_tutor else None,
+        von=filter_range[0].isoformat() if len(filter_range) > 0 else None,
+        bis=filter_range[1].isoformat() if len(filter_range) > 1 else None,
+        eingriff=_sel(filter_eingriff), zugang=_sel(filter_zugang),
+        verschlusssystem=_sel(filter_verschluss),
+    )
+
+    # ── Volltextsuche: Treffer nach Relevanz, seitenweise ──
+    if search:
+        if st.session_state.get("fts_sig") != (search, is_tutor):
+            st.session_state.fts_sig, st.session_state.fts_page = (search, is_tutor), 0
+        fts_page = st.session_state.fts_page
+        hits_df, hits = search_ops(username, is_tutor, search, fts_page, SEARCH_PAGE)
+        if hits_df.empty:
+            st.info(f"Keine Treffer für „{search}“.")
         else:
-            filter_user = username
-
-conditions, params = [], ()
-if filter_kat != "Alle":
-    conditions.append("kategorie=?"); params += (filter_kat,)
-if filter_rolle != "Alle":
-    conditions.append("rolle=?"); params += (filter_rolle,)
-if is_tutor and filter_user != "Alle":
-    conditions.append("username=?"); params += (filter_user,)
-
-extra = " AND ".join(conditions)
-df = fetch_ops(username, is_tutor, extra, params)
-
-if df.empty:
-    st.info("Keine Einträge vorhanden.")
-else:
-    def style_rolle(val):
-        if val == "Operateur": return f"color: {C['accent']}; font-weight: bold"
-        if val == "Assistent": return f"color: {C['accent2']}; font-weight: bold"
-        return ""
-    def style_kat(val):
-        m = {"Operation": C["op"], "Intervention": C["interv"], "Prozedur": C["proz"]}
-        c = m.get(val, C["text"])
-        return f"color: {c}; font-weight: bold"
-
-    styled = df.style
-    if "Rolle" in df.columns:
-        styled = styled.applymap(style_rolle, subset=["Rolle"])
-    if "Kategorie" in df.columns:
-        styled = styled.applymap(style_kat, subset=["Kategorie"])
-
-    st.dataframe(styled, use_container_width=True, hide_index=True, height=380)
-    st.caption(f"{len(df)} Einträge gefunden.")
-
-# ── Acciones exportar / borrar ──
-st.divider()
-a1, a2, a3, a4 = st.columns(4)
-
-with a1:
-    if not df.empty:
-        csv_buf = io.StringIO()
-        df.to_csv(csv_buf, index=False, encoding="utf-8")
-        st.download_button("📁 CSV herunterladen", csv_buf.getvalue(),
-                           "logbuch.csv", "text/csv",
-                           use_container_width=True)
-with a2:
-    if not df.empty:
-        pdf_bytes = make_pdf_bytes(df, "Logbuch - Chirurgischer Bericht")
-        st.download_button("📄 PDF herunterladen", pdf_bytes,
-                           "logbuch.pdf", "application/pdf",
-                           use_container_width=True)
-with a3:
-    if not is_tutor and not df.empty:
-        st.markdown(f"<p style='font-size:11px;color:{C['muted']};margin-bottom:4px'>"
-                    "Eintrag löschen (ID):</p>", unsafe_allow_html=True)
-        del_id = st.number_input("ID", min_value=1, step=1,
-                                 label_visibility="collapsed")
-with a4:
-    if not is_tutor and not df.empty:
-        if st.button("🗑 Löschen", use_container_width=True, type="secondary"):
-            conn = get_conn()
-            conn.execute("DELETE FROM operationen WHERE user_id=? AND username=?",
-                         (del_id, username))
-            conn.commit()
-            reorder_ids(username)
-            st.success(f"Eintrag {del_id} gelöscht.")
-            st.rerun()
+            st.dataframe(hits_df, use_container_width=True, hide_index=True,
+                         column_config=ops_column_config(C))
+            more = len(hits_df) == SEARCH_PAGE and (
+                hits > SEARCH_RANK_MAX or (fts_page + 1) * SEARCH_PAGE < hits)
+            sp1, sp2, sp3 = st.columns([0.5, 0.5, 4])
+            with sp1:
+                st.button("◀", key="fts_back", disabled=fts_page == 0,
+                          on_click=shift_fts_page, args=(-1,))
+            with sp2:
+                st.button("▶", key="fts_fwd", disabled=not more,
+                          on_click=shift_fts_page, args=(1,))
+            with sp3:
+                st.caption(f"Mehr als {SEARCH_RANK_MAX} Treffer, neueste zuerst · Seite {fts_page + 1}."
+                           if hits > SEARCH_RANK_MAX else
+                           f"{hits} Treffer nach Relevanz"
+                           f"{' (aktuelle Jahre, dann je Archivjahr)' if archived_years() else ''}"
+                           f" · Seite {fts_page + 1} von "
+                           f"{-(-hits // SEARCH_PAGE)}.")
+
+    n_total = count_ops(username, is_tutor, flt)
+
+    # ── Paginación keyset: pila de claves de inicio de cada página visitada ──
+    pg1, pg2, pg3, pg4 = st.columns([1.2, 0.5, 0.5, 3])
+    with pg1:
+        page_size = st.selectbox("Zeilen pro Seite", [25, 50, 100, 250], index=1)
+    log_sig = (username, is_tutor, flt, page_size)
+    if st.session_state.get("log_sig") != log_sig:
+        st.session_state.log_sig  = log_sig
+        st.session_state.log_keys = [None]
+    log_keys = st.session_state.log_keys
+    df, next_key = fetch_ops_page(username, is_tutor, flt, log_keys[-1], page_size)
+    with pg2:
+        st.markdown("<div style='height:28px'></div>", unsafe_allow_html=True)
+        st.button("◀", key="log_back", disabled=len(log_keys) == 1,
+                  on_click=log_page_back)
+    with pg3:
+        st.markdown("<div style='height:28px'></div>", unsafe_allow_html=True)
+        st.button("▶", key="log_fwd", disabled=next_key is None,
+                  on_click=log_page_fwd, args=(next_key,))
+
+    if df.empty:
+        st.info("Keine Einträge vorhanden.")
+    else:
+        with stage("dataframe", "render_logbuch") as rec:
+            rec["rows"] = len(df)
+            st.dataframe(df, use_container_width=True, hide_index=True, height=380,
+                         column_config=ops_column_config(C))
+        n_pages = -(-n_total // page_size)
+        st.caption(f"{n_total} Einträge gefunden · Seite {len(log_keys)} von {n_pages}.")
+
+    # ── Acciones exportar / borrar ──
+    st.divider()
+    a_exp, a3, a4 = st.columns([2, 1, 1])
+    with a_exp:
+        export_section(username, is_tutor, flt, n_total)
+    with a3:
+        if not is_tutor and not df.empty:
+            st.markdown(f"<p style='font-size:11px;color:{C['muted']};margin-bottom:4px'>"
+                        "Einträge löschen (IDs dieser Seite):</p>", unsafe_allow_html=True)
+            del_ids = st.multiselect("IDs", df["ID"].tolist(),
+                                     label_visibility="collapsed")
+    with a4:
+        if not is_tutor and not df.empty:
+            if st.button("🗑 Löschen", use_container_width=True, type="secondary",
+                         disabled=not del_ids):
+                n = delete_ops(username, del_ids)
+                flash("log_flash", f"{n} Eintrag/Einträge gelöscht.")
+                st.rerun()
+
+# Los exportes leen todas las filas filtradas: sólo se generan al pedirlos, en
+# segundo plano (jobs.py), y quedan en la caché de exportes (db.py) hasta la
+# próxima escritura. El año (resumen del PDF) se lee al ejecutar: el selector de
+# año rerun este fragmento.
+def show_job(job, label):
+    if job["state"] == "wartet":
+        st.progress(0.0, text=f"{label}: wartet (Position {job['position']})")
+    else:
+        st.progress(min(job["done"] / max(job["total"], 1), 1.0),
+                    text=f"{label}: {job['done']:,} / {job['total']:,} Zeilen")
+
+# Mientras un exporte está en marcha sólo este fragmento se refresca cada
+# segundo; al terminar se rerun la app para mostrar la descarga.
+@st.fragment(run_every=1)
+def export_progress(owner, kind, sig, label):
+    job = jobs.latest(owner, kind, sig)
+    if job is None or job["state"] not in jobs.ACTIVE:
+        st.rerun()
+    show_job(job, label)
+
+@st.fragment(key="export")
+@profiled("fragment", "export", cached=False)
+def export_section(username, is_tutor, flt, n_total):
+    if not n_total:
+        return
+    year         = st.session_state.sel_year
+    export_owner = None if is_tutor else username
+    export_sig   = (flt, year) if is_tutor else (flt, year, username)
+
+    def export_button(kind, label, fname, mime, spec):
+        data = peek_export(export_owner, kind, export_sig)
+        if data is not None:
+            st.download_button(f"{label} herunterladen", data, fname, mime,
+                               use_container_width=True)
+            return
+        job = jobs.latest(export_owner, kind, export_sig)
+        if job and job["state"] in jobs.ACTIVE:
+            export_progress(export_owner, kind, export_sig, label)
+            return
+        if job and job["state"] == "fehler":
+            st.error(f"{label} fehlgeschlagen: {job['error']}")
+        st.button(f"{label} erstellen", use_container_width=True, on_click=jobs.submit,
+                  args=(export_owner, kind, export_sig, n_total, spec))
+
+    a1, a2 = st.columns(2)
+    with a1:
+        fmt = st.selectbox("Format", list(EXPORT_FORMATS), label_visibility="collapsed")
+        _, ext, mime = EXPORT_FORMATS[fmt]
+        export_button(ext, f"📁 {fmt}", f"logbuch.{ext}", mime,
+                      jobs.ExportSpec(fmt, username, is_tutor, flt))
+    with a2:
+        export_button("pdf", f"📄 PDF {year}", "logbuch.pdf", "application/pdf",
+                      jobs.ExportSpec("PDF", username, is_tutor, flt,
+                                      "Logbuch - Chirurgischer Bericht", year))
+
+dashboard_section(username, is_tutor)
+if not is_tutor:
+    neue_op_section(username)
+logbuch_section(username, is_tutor)
+
+with st.sidebar:
+    st.divider()
+    if st.button("🚪 Abmelden", use_container_width=True):
+        for k in ["logged_in", "username", "is_tutor"]:
+            st.session_state[k] = False if k != "username" else ""
+        st.rerun()
+
+# ── Panel de profiling (sólo tutor, con ?profiling=1 en la URL) ──
+profiling.record("rerun", "logbuch", time.perf_counter() - RUN_T0)
+if is_tutor and st.query_params.get("profiling") == "1":
+    with st.sidebar, st.expander("⏱ Profiling", expanded=True):
+        stats, recent = profiling.snapshot()
+        if stats:
+            prof = pd.DataFrame(stats)
+            prof["ms/Aufruf"] = prof["seconds"] / prof["calls"] * 1000
+            prof["max ms"]    = prof["max_seconds"] * 1000
+            st.dataframe(prof[["kind", "name", "calls", "ms/Aufruf", "max ms",
+                               "rows", "hits", "misses"]]
+                         .sort_values("ms/Aufruf", ascending=False),
+                         hide_index=True, use_container_width=True,
+                         column_config={c: st.column_config.NumberColumn(format="%.1f")
+                                        for c in ("ms/Aufruf", "max ms")})
+        st.download_button("JSON", profiling.to_json(), "profiling.json",
+                           "application/json", use_container_width=True)
+        st.download_button("Prometheus", profiling.to_prometheus(), "profiling.prom",
+                           "text/plain; version=0.0.4", use_container_width=True)
+        if st.button("Zurücksetzen", use_container_width=True):
+            profiling.reset(); st.rerun()
@@ -0,0 +1,237 @@
+"""Tareas de mantenimiento de la base de datos del Logbuch.
+
+    python maintenance.py rebuild-rollup     # recalcula ops_rollup desde operationen
+    python maintenance.py rebuild-fts        # reconstruye ops_fts y completa el de los años archivados
+    python maintenance.py compact            # migra al esquema compacto e informa
+    python maintenance.py archive [--bis J]  # pasa los años cerrados a ficheros de archivo
+    python maintenance.py vacuum [--full]    # devuelve páginas libres (para cron)
+
+`vacuum` decide solo qué hace, así que puede ir en el crontab a diario:
+
+    15 3 * * *  cd /app && python maintenance.py vacuum
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+from datetime import date, datetime
+
+from streamlit.logger import set_log_level
+
+set_log_level("error")  # modo "bare": sin runtime de Streamlit
+import db  # noqa: E402
+
+def cmd_rebuild_rollup(args):
+    t0 = time.perf_counter()
+    with db.writer() as conn:
+        db.rebuild_rollup(conn)
+        n_ops, n_roll = (conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                         for t in ("operationen", "ops_rollup"))
+    print(f"ops_rollup: {n_roll} Zeilen aus {n_ops} Operationen "
+          f"({time.perf_counter() - t0:.2f}s)")
+
+def cmd_rebuild_fts(args):
+    t0 = time.perf_counter()
+    with db.writer() as conn:
+        conn.execute("INSERT INTO ops_fts (ops_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO ops_fts (ops_fts) VALUES ('optimize')")
+        n_ops = conn.execute("SELECT COUNT(*) FROM operationen").fetchone()[0]
+    print(f"ops_fts: {n_ops} Operationen indexiert ({time.perf_counter() - t0:.2f}s)")
+    # Los años archivados antes de tener índice propio se indexan aquí.
+    for jahr in db.archived_years():
+        n = db.index_archive(jahr)
+        print(f"{os.path.basename(db.archiv_pfad(jahr))}: {n} Operationen nachindexiert")
+
+# Consultas de referencia para `compact`: (nombre, SQL del esquema de texto,
+# SQL equivalente del esquema compacto); ? es el residente con más casos.
+COMPACT_QUERIES = [
+    ("Top-Eingriffe (Benutzer)",
+     "SELECT eingriff, rolle, COUNT(*) n FROM operationen WHERE username=? "
+     "GROUP BY eingriff, rolle ORDER BY n DESC LIMIT 10",
+     "SELECT e.name, r.name, g.n FROM (SELECT eingriff_id, rolle_id, COUNT(*) n "
+     "FROM operationen WHERE benutzer_id=(SELECT id FROM users WHERE username=?) "
+     "GROUP BY 1, 2 ORDER BY n DESC LIMIT 10) g "
+     "LEFT JOIN eingriffe e ON e.id=g.eingriff_id LEFT JOIN rollen r ON r.id=g.rolle_id"),
+    ("Eingriff × Jahr (alle)",
+     "SELECT eingriff, substr(datum_sort,1,4), COUNT(*) FROM operationen GROUP BY 1, 2",
+     "SELECT e.name, g.jahr, g.n FROM (SELECT eingriff_id, datum / 10000 jahr, COUNT(*) n "
+     "FROM operationen GROUP BY 1, 2) g LEFT JOIN eingriffe e ON e.id=g.eingriff_id"),
+    ("Fälle je Benutzer",
+     "SELECT username, COUNT(*) FROM operationen GROUP BY username",
+     "SELECT u.username, g.n FROM (SELECT benutzer_id, COUNT(*) n FROM operationen "
+     "GROUP BY 1) g LEFT JOIN users u ON u.id=g.benutzer_id"),
+    ("Zugang × Verschluss (alle)",
+     "SELECT zugang, verschlusssystem, COUNT(*) FROM operationen GROUP BY 1, 2",
+     "SELECT z.name, v.name, g.n FROM (SELECT zugang_id, verschlusssystem_id, COUNT(*) n "
+     "FROM operationen GROUP BY 1, 2) g LEFT JOIN zugaenge z ON z.id=g.zugang_id "
+     "LEFT JOIN verschlusssysteme v ON v.id=g.verschlusssystem_id"),
+]
+
+def _file_size(conn):
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db.DB_PATH)
+
+def _timings(conn, compact, user, repeat):
+    out = []
+    for _, legacy_sql, compact_sql in COMPACT_QUERIES:
+        sql  = compact_sql if compact else legacy_sql
+        p    = (user,) if "?" in sql else ()
+        runs = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(sql, p).fetchall()
+            runs.append(time.perf_counter() - t0)
+        out.append(statistics.median(runs) * 1000)
+    return out
+
+# Migra una base con el esquema de texto al compacto (migración _mig_compact)
+# sin arrancar la app, que si no lo haría sola en el primer arranque y sin
+# informe. Trae la base hasta la versión anterior, la compacta con VACUUM para
+# medir en igualdad de condiciones, migra, vuelve a compactar e informa del
+# tamaño del fichero y de COMPACT_QUERIES antes y después.
+def cmd_compact(args):
+    step = db.MIGRATIONS.index(db._mig_compact)
+    conn = sqlite3.connect(db.DB_PATH, timeout=db.BUSY_TIMEOUT_MS / 1000)
+    if conn.execute("PRAGMA user_version").fetchone()[0] > step:
+        print("Die Datenbank ist bereits im kompakten Schema.")
+        return
+    db._init_schema(conn, upto=step)
+    conn.execute("VACUUM")
+    size = [_file_size(conn)]
+    user = conn.execute("SELECT username FROM operationen GROUP BY username "
+                        "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    user = user[0] if user else ""
+    ms   = [_timings(conn, False, user, args.repeat)]
+    t0   = time.perf_counter()
+    db.migrate(conn)
+    secs = time.perf_counter() - t0
+    conn.execute("VACUUM")
+    size.append(_file_size(conn))
+    ms.append(_timings(conn, True, user, args.repeat))
+    n_ops = conn.execute("SELECT COUNT(*) FROM operationen").fetchone()[0]
+    conn.close()
+
+    print(f"{n_ops} Operationen migriert ({secs:.2f}s)")
+    print(f"{'Datei':<28}{size[0] / 2**20:>9.1f}MB{size[1] / 2**20:>9.1f}MB"
+          f"{(size[1] / size[0] - 1) * 100:>+8.0f}%")
+    print(f"{'Abfrage':<28}{'vorher':>11}{'nachher':>11}{'Faktor':>8}")
+    for (name, *_), b, a in zip(COMPACT_QUERIES, *ms):
+        print(f"{name:<28}{b:>9.2f}ms{a:>9.2f}ms{b / a if a else 0:>7.1f}x")
+
+# Registro de tareas periódicas (tabla wartung).
+def _zuletzt(conn, aufgabe):
+    row = conn.execute("SELECT zuletzt FROM wartung WHERE aufgabe=?", (aufgabe,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def _erledigt(conn, aufgabe):
+    conn.execute("INSERT INTO wartung (aufgabe, zuletzt) VALUES (?, ?) ON CONFLICT (aufgabe) "
+                 "DO UPDATE SET zuletzt = excluded.zuletzt",
+                 (aufgabe, datetime.now().isoformat(timespec="seconds")))
+
+# Pasa a ficheros de archivo (db.archive_year) los años con casos hasta --bis;
+# por defecto quedan en operationen el año en curso y los ARCHIV_HEISS - 1
+# anteriores. Sólo años cerrados. Las páginas que deja libres la base principal
+# las devuelve después `vacuum`.
+ARCHIV_HEISS = 2
+
+def cmd_archive(args):
+    heute = date.today().year
+    bis   = args.bis or heute - ARCHIV_HEISS
+    if bis >= heute:
+        raise SystemExit(f"Nur abgeschlossene Jahre können archiviert werden (--bis < {heute}).")
+    jahre = [j for j, in db.get_cur().execute(
+        "SELECT DISTINCT datum / 10000 FROM operationen WHERE datum BETWEEN 10000 AND ? "
+        "ORDER BY 1", (bis * 10000 + 9999,))]
+    if not jahre:
+        print(f"Keine Operationen bis {bis} in der Hauptdatenbank.")
+        return
+    for jahr in jahre:
+        t0 = time.perf_counter()
+        n  = db.archive_year(jahr)
+        print(f"{jahr}: {n} Operationen -> {os.path.basename(db.archiv_pfad(jahr))} "
+              f"({time.perf_counter() - t0:.2f}s)")
+    with db.writer() as conn:
+        _erledigt(conn, "archive")
+        free, size = (conn.execute(f"PRAGMA {p}").fetchone()[0]
+                      for p in ("freelist_count", "page_size"))
+        n_ops = conn.execute("SELECT COUNT(*) FROM operationen").fetchone()[0]
+    print(f"Hauptdatenbank: {n_ops} Operationen, {free * size / 2**20:.1f}MB frei "
+          f"(maintenance.py vacuum gibt sie zurück)")
+
+# La primera vez pasa la base a auto_vacuum=INCREMENTAL, que sólo surte efecto
+# con un VACUUM completo. Después cada ejecución devuelve las páginas libres
+# con incremental_vacuum (barato, sin reescribir la base) cuando pasan de
+# VACUUM_FREI del fichero, y sólo cada VACUUM_VOLL_TAGE días o con --full hace
+# un VACUUM completo, que además desfragmenta. Los ficheros de archivo sólo
+# cambian al borrar casos archivados o al archivar de nuevo su año: se
+# compactan cuando tienen páginas libres.
+VACUUM_FREI      = 0.05
+VACUUM_VOLL_TAGE = 30
+
+def _vacuum(conn, voll):
+    if voll:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # Cada paso de la sentencia libera una página; execute() sólo da el
+        # primero, executescript() la ejecuta hasta el final.
+        conn.executescript("PRAGMA incremental_vacuum")
+
+def cmd_vacuum(args):
+    conn = sqlite3.connect(db.DB_PATH, timeout=db.BUSY_TIMEOUT_MS / 1000)
+    db._init_schema(conn)
+    size = _file_size(conn)
+    free, pages = (conn.execute(f"PRAGMA {p}").fetchone()[0]
+                   for p in ("freelist_count", "page_count"))
+    last = _zuletzt(conn, "vacuum_voll")
+    voll = (args.full or last is None or (datetime.now() - last).days >= VACUUM_VOLL_TAGE
+            or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2)
+    if voll or free > pages * VACUUM_FREI:
+        t0 = time.perf_counter()
+        _vacuum(conn, voll)
+        _erledigt(conn, "vacuum_voll" if voll else "vacuum_inkrementell")
+        conn.commit()
+        print(f"Hauptdatenbank: {'VACUUM' if voll else 'incremental_vacuum'} "
+              f"{size / 2**20:.1f}MB -> {_file_size(conn) / 2**20:.1f}MB "
+              f"({free} freie Seiten, {time.perf_counter() - t0:.2f}s)")
+    else:
+        print(f"Hauptdatenbank: {free / max(pages, 1):.1%} frei, nichts zu tun")
+    for jahr, in conn.execute("SELECT jahr FROM archiv ORDER BY jahr").fetchall():
+        arch = sqlite3.connect(db.archiv_pfad(jahr), timeout=db.BUSY_TIMEOUT_MS / 1000)
+        if arch.execute("PRAGMA freelist_count").fetchone()[0]:
+            before = os.path.getsize(db.archiv_pfad(jahr))
+            arch.execute("VACUUM")
+            arch.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            print(f"{jahr}: VACUUM {before / 2**20:.1f}MB -> "
+                  f"{os.path.getsize(db.archiv_pfad(jahr)) / 2**20:.1f}MB")
+        arch.close()
+    conn.close()
+
+def main():
+    ap  = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", help="Pfad zur SQLite-Datei (Standard: LOGBUCH_DB)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild-rollup", help="ops_rollup neu aufbauen"
+                   ).set_defaults(func=cmd_rebuild_rollup)
+    sub.add_parser("rebuild-fts", help="Volltextindex ops_fts neu aufbauen"
+                   ).set_defaults(func=cmd_rebuild_fts)
+    p = sub.add_parser("compact", help="In das kompakte Schema migrieren "
+                                       "(Größe und Abfragezeiten vorher/nachher)")
+    p.add_argument("--repeat", type=int, default=5, help="Wiederholungen je Abfrage")
+    p.set_defaults(func=cmd_compact)
+    p = sub.add_parser("archive", help="Abgeschlossene Jahre in Archivdateien verschieben")
+    p.add_argument("--bis", type=int, help="letztes zu archivierendes Jahr "
+                                           f"(Standard: aktuelles Jahr - {ARCHIV_HEISS})")
+    p.set_defaults(func=cmd_archive)
+    p = sub.add_parser("vacuum", help="Freie Seiten zurückgeben (inkrementell, "
+                                      f"VACUUM alle {VACUUM_VOLL_TAGE} Tage)")
+    p.add_argument("--full", action="store_true", help="VACUUM jetzt erzwingen")
+    p.set_defaults(func=cmd_vacuum)
+    args = ap.parse_args()
+    if args.db:
+        db.DB_PATH = args.db
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
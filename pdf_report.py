@@ -0,0 +1,189 @@
+import io
+import zlib
+import calendar
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter, landscape
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFName, PDFStream
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas as rl_canvas
+
+from db import fetch_dashboard, fetch_ranking, iter_ops, ops_headers
+from katalog import ANNUAL_GOALS, KATEGORIEN
+
+# ─── PDF REPORT ───────────────────────────────────────────────────────────────
+# Las tablas se dibujan directamente sobre el canvas página a página: cada fila
+# se mide, se dibuja y se descarta. ReportLab guarda el contenido de todas las
+# páginas sin comprimir hasta save(); _Canvas lo comprime al cerrar cada página,
+# así la memoria crece con el PDF comprimido y no con las filas dibujadas.
+PAGE      = landscape(letter)
+MARGIN    = 36
+FONT      = "Helvetica"
+FONT_B    = "Helvetica-Bold"
+SIZE      = 7.5
+LEADING   = 9
+PAD       = 3
+MAX_LINES = 6     # líneas por celda; el resto se corta con "…"
+
+HEADER_BG = colors.HexColor("#1e2535")
+ZEBRA_BG  = colors.HexColor("#f2f4f8")
+GRID      = colors.HexColor("#c9cfdb")
+
+# Peso relativo del ancho de cada columna (por encabezado).
+COL_WEIGHTS = {
+    "ID": 0.45, "Datum": 0.9, "Eingriff": 2.2, "Rolle": 0.9, "Patient": 0.9,
+    "Diagnose": 2.0, "Kategorie": 1.0, "Zugang": 0.8, "Verschlusssystem": 1.4,
+    "Notizen": 2.2, "Benutzer": 1.2,
+}
+
+# Usa objetos internos de ReportLab (probado con 4.0–5.0, ver requirements.txt;
+# `benchmark.py pdf` comprueba que el PDF resultante se puede leer). Si faltan,
+# no se toca la página y ReportLab la comprime él mismo en save().
+class _Canvas(rl_canvas.Canvas):
+    def showPage(self):
+        super().showPage()
+        page = getattr(getattr(self._doc, "Pages", None), "pages", [None])[-1]
+        if isinstance(getattr(page, "stream", None), str) and not getattr(page, "Contents", 1):
+            stream = PDFStream(content=zlib.compress(page.stream.encode("latin-1")))
+            stream.dictionary["Filter"] = PDFArray([PDFName("FlateDecode")])
+            page.Contents, page.stream = stream, None
+
+class _Report:
+    def __init__(self, title):
+        self.buf   = io.BytesIO()
+        self.c     = _Canvas(self.buf, pagesize=PAGE, pageCompression=1)
+        self.title = title
+        self.page  = 0
+        self.c.setTitle(title)
+
+    def new_page(self, heading):
+        if self.page:
+            self.c.showPage()
+        self.page += 1
+        w, h = PAGE
+        self.c.setFont(FONT_B, 13); self.c.setFillColor(colors.black)
+        self.c.drawString(MARGIN, h - MARGIN - 4, heading)
+        self.c.setFont(FONT, 7); self.c.setFillColor(colors.grey)
+        self.c.drawString(MARGIN, MARGIN - 16, self.title)
+        self.c.drawRightString(w - MARGIN, MARGIN - 16,
+                               f"Seite {self.page} · {datetime.now():%d.%m.%Y}")
+        return h - MARGIN - 22
+
+    def _cell_lines(self, text, width, font):
+        if stringWidth(text, font, SIZE) <= width - 2 * PAD:
+            return [text]
+        lines = simpleSplit(text, font, SIZE, width - 2 * PAD) or [""]
+        if len(lines) > MAX_LINES:
+            lines = lines[:MAX_LINES]; lines[-1] = lines[-1][:-1] + "…"
+        return lines
+
+    def _layout(self, cells, widths, font):
+        lines = [self._cell_lines(t, w, font) for t, w in zip(cells, widths)]
+        return lines, max(len(l) for l in lines) * LEADING + 2 * PAD
+
+    def _draw_row(self, y, lines, height, widths, font, fill=None,
+                  text_color=colors.black):
+        if fill is not None:
+            self.c.setFillColor(fill)
+            self.c.rect(MARGIN, y - height, sum(widths), height, stroke=0, fill=1)
+        self.c.setStrokeColor(GRID); self.c.setLineWidth(0.3)
+        self.c.line(MARGIN, y - height, MARGIN + sum(widths), y - height)
+        # Un solo objeto de texto por fila, con desplazamientos relativos.
+        t = self.c.beginText(MARGIN + PAD, y - PAD - SIZE)
+        t.setFont(font, SIZE, LEADING); t.setFillColor(text_color)
+        for cell, w in zip(lines, widths):
+            for line in cell:
+                t.textLine(line)
+            t.moveCursor(w, -LEADING * len(cell))
+        self.c.drawText(t)
+        return height
+
+    # Dibuja una tabla paginada a partir de un iterable de bloques de filas,
+    # repitiendo el encabezado en cada página.
+    def table(self, heading, headers, chunks, weights=None, intro=None):
+        weights = weights or [COL_WEIGHTS.get(h, 1.0) for h in headers]
+        avail   = PAGE[0] - 2 * MARGIN
+        widths  = [avail * w / sum(weights) for w in weights]
+        bottom  = MARGIN
+        y, n, first = None, 0, True
+
+        def start_page():
+            top = self.new_page(heading if first else f"{heading} (Forts.)")
+            if first and intro:
+                top = self.text_lines(top - 6, intro) - 4
+            return top - self._draw_row(top, *self._layout(headers, widths, FONT_B),
+                                        widths, FONT_B, fill=HEADER_BG,
+                                        text_color=colors.white)
+
+        for rows in chunks:
+            for row in rows:
+                cells = ["" if v is None else str(v) for v in row]
+                lines, height = self._layout(cells, widths, FONT)
+                if y is None or y - height < bottom:
+                    y = start_page(); first = False
+                y -= self._draw_row(y, lines, height, widths, FONT,
+                                    fill=ZEBRA_BG if n % 2 else None)
+                n += 1
+        if y is None:
+            start_page()
+        return n
+
+    def text_lines(self, y, lines, size=10):
+        self.c.setFillColor(colors.black)
+        for text, bold in lines:
+            self.c.setFont(FONT_B if bold else FONT, size)
+            self.c.drawString(MARGIN, y, text); y -= size + 5
+        return y
+
+    def finish(self):
+        self.c.save()
+        return self.buf.getvalue()
+
+# Páginas de resumen por categoría a partir de los mismos agregados que el
+# dashboard (db.fetch_dashboard y, para el tutor, fetch_ranking).
+def _summary_pages(rep, summary):
+    year, goals, dash = summary["year"], summary["goals"], summary["dashboard"]
+    for kat in summary["kategorien"]:
+        total  = dash.totals.get(kat, 0)
+        goal   = goals.get(kat, 0)
+        pct    = f" ({min(total / goal, 1.0):.0%})" if goal else ""
+        months = [(calendar.month_abbr[m], n) for m, n in enumerate(dash.month(kat), 1)]
+        rows    = months + [(f"Summe {year}", sum(n for _, n in months))]
+        headers = ["Monat", "Anzahl"]
+        ranking = summary.get("ranking", {}).get(kat)
+        if ranking:
+            rk   = ranking[:len(rows)] + [("", "")] * max(len(rows) - len(ranking), 0)
+            rows = [m + tuple(r) for m, r in zip(rows, rk)]
+            headers += ["Benutzer (gesamt)", "Anzahl"]
+        rep.table(f"Zusammenfassung · {kat}", headers, [rows],
+                  weights=[1] * len(headers), intro=[
+                      (f"Gesamt: {total}", True),
+                      (f"Jahresziel: {total}/{goal}{pct}", False),
+                      (f"Monatsverlauf {year}", True),
+                  ])
+
+def make_report_pdf(title, headers, chunks, summary=None):
+    rep = _Report(title)
+    if summary:
+        _summary_pages(rep, summary)
+    rep.table(title, headers, chunks)
+    return rep.finish()
+
+# Exporte PDF del Logbuch con la selección actual (filtro `flt`) y el resumen
+# del año: del residente o, para el tutor, de todos con el ranking. `chunks`
+# permite pasar las filas ya abiertas (p. ej. con seguimiento del progreso).
+def make_pdf_bytes(username, is_tutor, flt, title, year, chunks=None):
+    scope   = None if is_tutor else username
+    summary = dict(year=year, kategorien=KATEGORIEN, goals=ANNUAL_GOALS,
+                   dashboard=fetch_dashboard(scope, year))
+    if is_tutor:
+        ranking = fetch_ranking()
+        summary["ranking"] = {
+            kat: sorted(((r[0], r[2 + i]) for r in ranking if r[2 + i]),
+                        key=lambda x: -x[1])
+            for i, kat in enumerate(KATEGORIEN)}
+    if chunks is None:
+        chunks = iter_ops(username, is_tutor, flt)
+    return make_report_pdf(title, ops_headers(is_tutor), chunks, summary)
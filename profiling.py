@@ -0,0 +1,114 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import streamlit as st
+
+# ─── PROFILING ────────────────────────────────────────────────────────────────
+# Tiempos por etapa (sql, dataframe, styler, plotly, pdf, export) compartidos
+# por todas las sesiones del proceso: acumulados por (etapa, nombre) más los
+# últimos RECENT_MAX eventos. Las funciones con st.cache_data marcan `miss()`
+# dentro del cuerpo cacheado; si no se ejecutó, la llamada fue un acierto.
+RECENT_MAX = 500
+
+_local = threading.local()
+
+@st.cache_resource
+def _registry():
+    return {"lock": threading.Lock(), "stats": {}, "recent": deque(maxlen=RECENT_MAX)}
+
+def record(kind, name, secs, rows=None, cache=None):
+    r = _registry()
+    with r["lock"]:
+        s = r["stats"].setdefault((kind, name), dict(
+            calls=0, seconds=0.0, max_seconds=0.0, rows=0, hits=0, misses=0))
+        s["calls"] += 1; s["seconds"] += secs
+        s["max_seconds"] = max(s["max_seconds"], secs)
+        s["rows"] += rows or 0
+        if cache is not None:
+            s["hits" if cache == "hit" else "misses"] += 1
+        r["recent"].append(dict(ts=time.time(), kind=kind, name=name,
+                                ms=round(secs * 1000, 3), rows=rows, cache=cache))
+
+# `with stage("dataframe", "df_rank") as rec: ...; rec["rows"] = len(df)`
+@contextmanager
+def stage(kind, name):
+    rec, t0 = {"rows": None, "cache": None}, time.perf_counter()
+    try:
+        yield rec
+    finally:
+        record(kind, name, time.perf_counter() - t0, rec["rows"], rec["cache"])
+
+def miss():
+    _local.miss = True
+
+def _rows(result):
+    if isinstance(result, tuple) and result:
+        result = result[0]      # (DataFrame, …) de fetch_ops_page, search_ops, Cohort
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+# Decorador para las funciones públicas de lectura (fetch_*, count_ops, ...);
+# cached=False para las que no pasan por st.cache_data.
+def profiled(kind, name=None, cached=True):
+    def deco(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            outer, _local.miss = getattr(_local, "miss", False), False
+            with stage(kind, label) as rec:
+                result = fn(*args, **kwargs)
+                rec["rows"]  = _rows(result)
+                if cached:
+                    rec["cache"] = "miss" if _local.miss else "hit"
+            _local.miss = outer
+            return result
+        return wrapper
+    return deco
+
+# Decorador para el cuerpo de las funciones cacheadas (bajo @st.cache_data).
+def cached_body(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        miss()
+        return fn(*args, **kwargs)
+    return wrapper
+
+def snapshot():
+    r = _registry()
+    with r["lock"]:
+        stats  = [dict(kind=k, name=n, **s) for (k, n), s in sorted(r["stats"].items())]
+        recent = list(r["recent"])
+    return stats, recent
+
+def reset():
+    r = _registry()
+    with r["lock"]:
+        r["stats"].clear(); r["recent"].clear()
+
+def to_json():
+    stats, recent = snapshot()
+    return json.dumps(dict(stats=stats, recent=recent), indent=1)
+
+_PROM = [
+    ("calls",       "logbuch_stage_calls_total",        "counter", "Aufrufe je Etappe"),
+    ("seconds",     "logbuch_stage_seconds_total",      "counter", "Gesamtzeit in Sekunden"),
+    ("max_seconds", "logbuch_stage_seconds_max",        "gauge",   "Längster Aufruf in Sekunden"),
+    ("rows",        "logbuch_stage_rows_total",         "counter", "Verarbeitete Zeilen"),
+    ("hits",        "logbuch_stage_cache_hits_total",   "counter", "Cache-Treffer"),
+    ("misses",      "logbuch_stage_cache_misses_total", "counter", "Cache-Fehlschläge"),
+]
+
+def to_prometheus():
+    stats, _ = snapshot()
+    out = []
+    for field, metric, typ, help_ in _PROM:
+        out += [f"# HELP {metric} {help_}", f"# TYPE {metric} {typ}"]
+        out += [f'{metric}{{stage="{s["kind"]}",name="{s["name"]}"}} {s[field]}'
+                for s in stats]
+    return "\n".join(out) + "\n"
@@ -0,0 +1,19 @@
+import streamlit as st
+
+# ─── ESTILO DE LA TABLA LOGBUCH ───────────────────────────────────────────────
+# Rolle y Kategorie se colorean en el navegador con column_config: el valor de
+# la celda (un string) se muestra como etiqueta de color de su opción. No hay
+# Styler, así que el coste en Python no depende del número de filas.
+ROLLE_COLORS = {"Operateur": "accent", "Assistent": "accent2"}
+KAT_COLORS   = {"Operation": "op", "Intervention": "interv", "Prozedur": "proz"}
+
+def _label_column(label, colors, palette):
+    return st.column_config.MultiselectColumn(
+        label, options=list(colors), color=[palette[k] for k in colors.values()],
+        disabled=True)
+
+def ops_column_config(palette):
+    return {
+        "Rolle":     _label_column("Rolle", ROLLE_COLORS, palette),
+        "Kategorie": _label_column("Kategorie", KAT_COLORS, palette),
+    }